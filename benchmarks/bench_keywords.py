@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""키워드 분류기 마이크로 벤치마크: 예전 `in` 반복 검사 vs 컴파일된 키워드 정규식 한 번 훑기
+
+예전 검사는 있다/없다만 보고 첫 적중에서 멈추지만 새 분류기는 모든 적중을 위치와 함께 모으므로
+키워드가 빽빽한 소설 전문에서는 더 느림 (앱은 소설 전문을 분류하지 않음)
+
+    python benchmarks/bench_keywords.py [--repeat 200]
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from keyword_matcher import load_keyword_classifier  # noqa: E402
+
+classifier = load_keyword_classifier()
+categories = classifier.categories
+
+
+def legacy_check_inappropriate_content(user_message):
+    """예전 구현 (키워드마다 문장 전체를 다시 훑음)"""
+    for keyword in categories["profanity"]:
+        if keyword in user_message:
+            return True, keyword
+    for main_word, trigger_words in categories["context_sensitive"].items():
+        if main_word in user_message:
+            for trigger in trigger_words:
+                if trigger in user_message:
+                    return True, main_word + " " + trigger
+    return False, None
+
+
+def legacy_check_off_topic(user_message):
+    has_novel_keyword = any(keyword in user_message for keyword in categories["novel_terms"])
+    has_off_topic = any(keyword in user_message for keyword in categories["off_topic_terms"])
+    return len(user_message) > 3 and not has_novel_keyword and has_off_topic
+
+
+def legacy_analyze_review_for_final_question(review_content, conversation_messages):
+    """예전 구현 (호출할 때마다 대화 전체를 이어붙여 다시 훑음)"""
+    conversation_text = " ".join([msg["content"] for msg in conversation_messages])
+    unused_topics = []
+    for topic, keywords in categories["review_topics"].items():
+        in_review = any(keyword in review_content for keyword in keywords)
+        in_conversation = any(keyword in conversation_text for keyword in keywords)
+        if in_review and not in_conversation:
+            unused_topics.append(topic)
+    return unused_topics
+
+
+def new_check_inappropriate_content(user_message, hits):
+    expression = classifier.find_inappropriate(hits)
+    return expression is not None, expression
+
+
+def new_check_off_topic(user_message, hits):
+    return len(user_message) > 3 and not hits["novel_terms"] and bool(hits["off_topic_terms"])
+
+
+def new_checks(user_message):
+    """앱처럼 메시지를 한 번만 훑고 두 검사가 결과를 같이 씀"""
+    hits = classifier.classify(user_message)
+    return new_check_inappropriate_content(user_message, hits), new_check_off_topic(user_message, hits)
+
+
+def new_analyze_review_for_final_question(review_content, covered_topics):
+    review_topics = classifier.topics(classifier.classify(review_content))
+    return [t for t in categories["review_topics"] if t in review_topics and t not in covered_topics]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    novel = (ROOT / "novel_star.txt").read_text(encoding="utf-8")
+    # 키워드가 거의 없는 긴 메시지(최악의 경우)와 소설 본문(적중이 많은 경우)
+    long_plain = "그냥 오늘은 아무 생각 없이 창밖을 봤는데 구름이 예쁘더라. " * 40
+    inputs = {"짧은 메시지": "누이가 왜 그랬을까?", "긴 일반 문장": long_plain, "소설 전문": novel}
+
+    # 같은 결과를 내는지 먼저 확인
+    for text in inputs.values():
+        assert (legacy_check_inappropriate_content(text), legacy_check_off_topic(text)) == new_checks(text)
+
+    print(f"{'입력':<12}{'길이':>8}{'예전(ms)':>12}{'새(ms)':>12}{'배율':>8}")
+    for name, text in inputs.items():
+        legacy = timeit.timeit(lambda: (legacy_check_inappropriate_content(text), legacy_check_off_topic(text)),
+                               number=args.repeat) / args.repeat * 1000
+        new = timeit.timeit(lambda: new_checks(text), number=args.repeat) / args.repeat * 1000
+        print(f"{name:<12}{len(text):>8}{legacy:>12.3f}{new:>12.3f}{legacy / new:>8.1f}")
+
+    # 마지막 질문용 주제 분석: 대화가 길어질수록 예전 방식은 매번 전체를 다시 훑음
+    messages = [{"role": "user", "content": long_plain[:200]} for _ in range(60)]
+    covered = set()
+    for m in messages:
+        covered |= classifier.topics(classifier.classify(m["content"]))
+    review = novel[:1500]
+    assert legacy_analyze_review_for_final_question(review, messages) == new_analyze_review_for_final_question(review, covered)
+    legacy = timeit.timeit(lambda: legacy_analyze_review_for_final_question(review, messages),
+                           number=args.repeat) / args.repeat * 1000
+    new = timeit.timeit(lambda: new_analyze_review_for_final_question(review, covered),
+                        number=args.repeat) / args.repeat * 1000
+    print(f"{'주제 분석(60턴)':<12}{'':>8}{legacy:>12.3f}{new:>12.3f}{legacy / new:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
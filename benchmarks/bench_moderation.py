@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""2단계 의미 검사 벤치마크: 키워드만 쓰던 예전 판정 vs 키워드 + 로컬 분류기, 정확도와 지연
+
+    python benchmarks/bench_moderation.py [--cases benchmarks/moderation_cases.jsonl --first-token 0.3]
+
+moderation_cases.jsonl은 학습용 moderation_train.jsonl과 겹치지 않는 라벨 붙은 메시지 모음
+(소설 인용, 줄거리 속 "죽어", 키워드 없이 돌려 말한 딴 얘기·욕설 등 키워드 검사가 틀리기 쉬운 경우 포함).
+지연은 두 가지를 잼: 검사 자체의 시간, 그리고 LLM 첫 토큰 지연을 흉내 낸 스트림에 검사를 겹쳤을 때 늘어난 시간.
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from keyword_matcher import load_keyword_classifier  # noqa: E402
+from litbot_core import BACKUP_SUMMARY, PromptBuilder, load_novel_artifacts  # noqa: E402
+from semantic_checker import LABELS, ModerationFlag, load_semantic_checker, moderated_stream  # noqa: E402
+
+CASES_PATH = Path(__file__).resolve().parent / "moderation_cases.jsonl"
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else float("nan")
+
+
+def keyword_label(classifier, text, hits):
+    """예전 판정 (키워드만): 욕설·문맥 의존 표현이면 부적절, 소설 단어 없이 딴 주제 단어가 있으면 주제 이탈"""
+    if classifier.find_inappropriate(hits):
+        return "inappropriate"
+    if len(text) > 3 and not hits["novel_terms"] and hits["off_topic_terms"]:
+        return "off_topic"
+    return "ok"
+
+
+def report(name, cases, predicted):
+    confusion = {gold: {label: 0 for label in LABELS} for gold in LABELS}
+    for case, label in zip(cases, predicted):
+        confusion[case["label"]][label] += 1
+    correct = sum(confusion[label][label] for label in LABELS)
+    print(f"\n[{name}] 정확도 {correct / len(cases):.1%} ({correct}/{len(cases)})")
+    print(f"  {'라벨':<14}{'정밀도':>8}{'재현율':>8}   혼동 행렬 (행: 정답, 열: 판정 {' / '.join(LABELS)})")
+    for label in LABELS:
+        tp = confusion[label][label]
+        flagged = sum(confusion[gold][label] for gold in LABELS)
+        actual = sum(confusion[label].values())
+        precision = tp / flagged if flagged else float("nan")
+        recall = tp / actual if actual else float("nan")
+        row = " ".join(f"{confusion[label][other]:>3}" for other in LABELS)
+        print(f"  {label:<14}{precision:>8.2f}{recall:>8.2f}   {row}")
+    return correct / len(cases)
+
+
+def fake_llm_stream(first_token, timing, chunks=20, chunk_delay=0.005):
+    """첫 토큰 지연을 흉내 낸 LLM 스트림 (마지막 조각을 내보낸 시각을 timing에 적음)"""
+    time.sleep(first_token)
+    for i in range(chunks):
+        if i:
+            time.sleep(chunk_delay)
+        yield "조각 "
+    timing["upstream_done"] = time.perf_counter()
+
+
+def consume(stream):
+    try:
+        return "".join(stream), False
+    except ModerationFlag:
+        return None, True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", default=str(CASES_PATH), help="라벨 붙은 메시지 JSONL")
+    parser.add_argument("--repeat", type=int, default=20, help="지연 측정 반복 횟수 (메시지마다)")
+    parser.add_argument("--first-token", type=float, default=0.3, help="흉내 낸 LLM 첫 토큰 지연(초)")
+    parser.add_argument("--verbose", action="store_true", help="틀린 메시지와 점수 출력")
+    args = parser.parse_args()
+
+    with open(args.cases, encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+
+    start = time.perf_counter()
+    novel = load_novel_artifacts()
+    novel_text = novel["text"] if novel else BACKUP_SUMMARY
+    classifier = load_keyword_classifier()
+    checker = load_semantic_checker(classifier, PromptBuilder(novel_text).passage_index, novel_text)
+    print(f"검사기 준비 {(time.perf_counter() - start) * 1000:.0f}ms (색인 + 학습, 서버 프로세스당 한 번), "
+          f"메시지 {len(cases)}개")
+
+    hits = [classifier.classify(case["text"]) for case in cases]
+    keyword = [keyword_label(classifier, case["text"], h) for case, h in zip(cases, hits)]
+    verdicts = [checker.check(case["text"], h) for case, h in zip(cases, hits)]
+    report("키워드만 (예전)", cases, keyword)
+    report("키워드 + 의미 검사", cases, [v["label"] for v in verdicts])
+    if args.verbose:
+        for case, old, verdict in zip(cases, keyword, verdicts):
+            if verdict["label"] != case["label"] or old != case["label"]:
+                print(f"  정답 {case['label']:<13} 예전 {old:<13} 지금 {verdict['label']:<13} {case['text']}  "
+                      f"{verdict['probs']} sim={verdict['novel_similarity']} quote={verdict['quote_ratio']}")
+
+    samples = []
+    for _ in range(args.repeat):
+        for case, h in zip(cases, hits):
+            t = time.perf_counter()
+            checker.check(case["text"], h)
+            samples.append((time.perf_counter() - t) * 1000)
+    print(f"\n검사 시간 (메시지 하나, ms): p50 {percentile(samples, 0.5):.2f}, p95 {percentile(samples, 0.95):.2f}, "
+          f"최대 {max(samples):.2f}")
+
+    # LLM 호출과 겹쳤을 때 실제로 늘어나는 턴 시간 = LLM 스트림이 끝난 뒤 검사 결과를 기다린 시간
+    # 걸리지 않은 메시지만 잼 (걸린 메시지는 첫 조각에서 끊겨서 오히려 짧아짐)
+    passed = [(case, h) for case, h, v in zip(cases, hits, verdicts) if not v["flagged"]]
+    overhead = []
+    wrong = 0
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        for _ in range(max(1, args.repeat // 10)):
+            for case, h in passed:
+                timing = {}
+                stream = fake_llm_stream(args.first_token, timing)
+                _, flagged = consume(moderated_stream(stream, pool.submit(checker.check, case["text"], h)))
+                overhead.append((time.perf_counter() - timing["upstream_done"]) * 1000)
+                wrong += flagged
+        for case, h, v in zip(cases, hits, verdicts):
+            if v["flagged"]:
+                timing = {}
+                stream = fake_llm_stream(args.first_token, timing)
+                _, flagged = consume(moderated_stream(stream, pool.submit(checker.check, case["text"], h)))
+                wrong += not flagged  # 걸린 메시지인데 스트림이 끊기지 않았으면 잘못
+                if "upstream_done" in timing:
+                    wrong += 1  # 첫 조각에서 끊겼어야 함
+    print(f"LLM 스트림(첫 토큰 {args.first_token * 1000:.0f}ms)과 겹쳤을 때 늘어난 턴 시간 (ms): "
+          f"p50 {percentile(overhead, 0.5):.3f}, p95 {percentile(overhead, 0.95):.3f} "
+          f"(측정 {len(overhead)}회, 끊기 판단이 어긋난 경우 {wrong}회)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
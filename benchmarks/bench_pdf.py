@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""감상문 PDF 추출 벤치마크: 쪽 수별 추출 시간과 텍스트 크기
+
+    python benchmarks/bench_pdf.py [--pages 1 10 30 100] [--repeat 5]
+
+novel_star.txt 본문으로 여러 쪽짜리 PDF를 메모리에서 만들어 review_pdf.extract_pdf_text로 읽음.
+"""
+import argparse
+import statistics
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import fitz  # noqa: E402  PyMuPDF
+
+from review_pdf import extract_pdf_text  # noqa: E402
+
+
+def make_pdf(page_count, text):
+    """A4 한 쪽에 본문 일부씩 넣은 page_count쪽짜리 PDF 바이트"""
+    doc = fitz.open()
+    chunk = 900
+    for i in range(page_count):
+        start = (i * chunk) % max(1, len(text) - chunk)
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 545, 792), text[start:start + chunk], fontname="korea", fontsize=10)
+    content = doc.tobytes()
+    doc.close()
+    return content
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 30, 100])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-pages", type=int, default=30, help="앱의 PDF_MAX_PAGES와 같은 제한")
+    args = parser.parse_args()
+
+    text = (ROOT / "novel_star.txt").read_text(encoding="utf-8")
+    print(f"{'쪽 수':>6}{'PDF(KB)':>10}{'읽은 쪽':>8}{'글자 수':>10}{'p50(ms)':>10}{'최대(ms)':>10}{'쪽당(ms)':>10}")
+    for page_count in args.pages:
+        content = make_pdf(page_count, text)
+        timings = []
+        for _ in range(args.repeat):
+            result = extract_pdf_text(content, max_pages=args.max_pages)
+            timings.append(result["elapsed"] * 1000)
+        p50 = statistics.median(timings)
+        print(f"{page_count:>6}{len(content) / 1024:>10.1f}{result['pages']:>8}{result['chars']:>10,}"
+              f"{p50:>10.2f}{max(timings):>10.2f}{p50 / max(1, result['pages']):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
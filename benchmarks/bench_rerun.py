@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""재실행(rerun)·import 시간 측정: 지금 스크립트와 예전 리비전을 같은 조건으로 비교
+
+    python benchmarks/bench_rerun.py --baseline HEAD~1 [--reruns 30 --turns 3]
+
+Streamlit은 상호작용마다 스크립트 전체를 다시 실행하므로, 학생이 체감하는 지연은 (LLM 대기 시간을 뺀)
+재실행 한 번의 시간임. LLM은 지연 0인 로컬 대역 서버(mock_services.py)로 바꿔서 앱 자체의 비용만 잼.
+변형마다 새 파이썬 프로세스에서 돌려서 import 캐시가 섞이지 않게 함.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+SCRIPT = ROOT / "streamlit_litbot.py"
+REVIEW = "소년은 누이가 어머니를 닮지 않았다고 생각해서 누이를 미워했다. 누이가 죽고 나서야 소년은 눈물을 흘렸다."
+TURN = "나는 소년이 누이를 미워하는 게 잘 이해가 안 됐어."
+IMPORT_MODULES = ["streamlit", "openai", "fitz", "requests", "smtplib", "litbot_core", "review_pdf",
+                  "keyword_matcher", "session_store", "semantic_checker"]
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else float("nan")
+
+
+def import_time(module):
+    """새 프로세스에서 모듈 하나를 import하는 데 걸린 시간(ms), 설치돼 있지 않으면 None"""
+    code = (f"import sys, time; sys.path.insert(0, {str(ROOT)!r}); t = time.perf_counter(); import {module}; "
+            f"print((time.perf_counter() - t) * 1000)")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    # 마지막 줄만 읽음 (새 PyMuPDF는 import fitz 때 경고 문구를 먼저 찍음)
+    return float(result.stdout.splitlines()[-1]) if result.returncode == 0 else None
+
+
+def measure_script(script, reruns, turns, timeout):
+    """(자식 프로세스) 스크립트 하나의 첫 실행·유휴 재실행·대화 턴 시간(ms)"""
+    from streamlit.testing.v1 import AppTest
+    from mock_services import MockLLMServer
+
+    llm = MockLLMServer(latency=0, jitter=0, chunk_delay=0).start()
+    workdir = tempfile.mkdtemp(prefix="litbot-bench-")
+    app = AppTest.from_file(script, default_timeout=timeout)
+    app.secrets["claude"] = {"api_key": "mock", "base_url": llm.base_url}
+    app.secrets["openai"] = {"api_key": "mock", "base_url": llm.base_url + "/v1"}
+    app.secrets["email"] = {"user": "litbot@example.com", "password": "mock", "smtp_host": "127.0.0.1",
+                            "smtp_port": 9, "smtp_ssl": False, "outbox_dir": workdir}
+    app.secrets["sessions"] = {"path": str(Path(workdir) / "sessions.sqlite3")}
+    app.secrets["telemetry"] = {"path": str(Path(workdir) / "events.jsonl")}
+
+    def timed(action=None):
+        start = time.perf_counter()
+        if action:
+            action()
+        app.run(timeout=timeout)
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+        return (time.perf_counter() - start) * 1000
+
+    result = {"first_run": timed()}
+    app.text_input(key="lastname").input("김")
+    app.text_input(key="firstname").input("벤치")
+    if any(widget.key == "student_code" for widget in app.text_input):  # 예전 리비전에는 없는 입력
+        app.text_input(key="student_code").input("bench")
+    timed()
+    app.radio(key="review_method").set_value("직접 입력")
+    timed()  # 입력 칸은 다음 실행에서 나타남
+    app.text_area(key="review_text").input(REVIEW)
+    timed()
+    result["review_submit"] = timed(lambda: app.button[0].click())
+    result["idle_rerun"] = [timed() for _ in range(reruns)]
+    result["chat_turn"] = [timed(lambda: app.chat_input[0].set_value(TURN)) for _ in range(turns)]
+    result["idle_rerun_after_chat"] = [timed() for _ in range(reruns)]
+    llm.stop()
+    return result
+
+
+def run_variant(label, script, args):
+    output = subprocess.run(
+        [sys.executable, __file__, "--measure", str(script), "--reruns", str(args.reruns),
+         "--turns", str(args.turns), "--timeout", str(args.timeout)],
+        capture_output=True, text=True, cwd=ROOT,
+    )
+    if output.returncode != 0:
+        raise RuntimeError(f"{label} 측정 실패:\n{output.stderr[-2000:]}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline", help="비교할 git 리비전 (예: HEAD~1)")
+    parser.add_argument("--reruns", type=int, default=30, help="유휴 재실행 측정 횟수")
+    parser.add_argument("--turns", type=int, default=3, help="대화 턴 측정 횟수")
+    parser.add_argument("--timeout", type=float, default=60, help="실행 한 번의 제한 시간(초)")
+    parser.add_argument("--json", help="결과를 JSON으로도 저장할 경로")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)  # 자식 프로세스용
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure_script(args.measure, args.reruns, args.turns, args.timeout)))
+        return 0
+
+    imports = {module: import_time(module) for module in IMPORT_MODULES}
+    print("모듈 import 시간 (새 프로세스, ms)")
+    for module, ms in imports.items():
+        print(f"  {module:<16}{'설치 안 됨' if ms is None else f'{ms:>9.1f}'}")
+
+    variants = [("현재", SCRIPT)]
+    baseline_path = None
+    if args.baseline:
+        # 예전 스크립트도 같은 폴더에 있어야 옆 모듈(keyword_matcher 등)을 찾음
+        baseline_path = ROOT / f".bench_baseline_{args.baseline.replace('~', '_').replace('/', '_')}.py"
+        source = subprocess.run(["git", "show", f"{args.baseline}:streamlit_litbot.py"],
+                                capture_output=True, check=True, cwd=ROOT).stdout
+        baseline_path.write_bytes(source)
+        variants.insert(0, (args.baseline, baseline_path))
+
+    results = {}
+    try:
+        for label, script in variants:
+            results[label] = run_variant(label, script, args)
+    finally:
+        if baseline_path:
+            baseline_path.unlink(missing_ok=True)
+
+    print(f"\n{'변형':<12}{'첫 실행':>10}{'감상문 제출':>12}{'유휴 p50':>10}{'유휴 p95':>10}{'턴 p50':>10}{'대화 후 유휴 p50':>16}")
+    for label, r in results.items():
+        print(f"{label:<12}{r['first_run']:>10.1f}{r['review_submit']:>12.1f}"
+              f"{percentile(r['idle_rerun'], 0.5):>10.1f}{percentile(r['idle_rerun'], 0.95):>10.1f}"
+              f"{percentile(r['chat_turn'], 0.5):>10.1f}{percentile(r['idle_rerun_after_chat'], 0.5):>16.1f}")
+    print("(단위 ms, LLM 지연 0)")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "imports_ms": imports,
+            "variants": {label: {**r, "idle_rerun_mean": statistics.fmean(r["idle_rerun"])}
+                         for label, r in results.items()},
+        }, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
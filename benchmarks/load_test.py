@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""교실 부하 테스트: 학생 N명이 동시에 streamlit_litbot.py 전체 흐름을 진행할 때의 지연 시간 측정
+
+    python benchmarks/load_test.py --sessions 30 --turns 5 --latency 0.8 --error-rate 0.05
+
+Streamlit AppTest로 실제 스크립트를 세션마다 돌리고, Anthropic·OpenAI·Gmail은 로컬 대역 서버
+(mock_services.py)로 바꿔 끼움. 단계별 p50/p95/p99, 처리량, 세션당 메모리를 출력함.
+
+AppTest는 Streamlit 런타임과 secrets를 프로세스 전역에 두어서 한 프로세스에서 여러 세션을 동시에 못 돌림.
+그래서 세션마다 프로세스를 따로 띄우고(모두 import를 마치면 함께 출발) 대역 서버만 같이 씀.
+프로세스마다 캐시 리소스(입장 관리자·발송함·세션 저장소)가 따로 생기므로, 반 전체 한도가 같아지도록
+LLM 한도를 세션 수로 나눠 주고 발송함·세션 DB·이벤트 기록은 세션별 폴더에 둠.
+"""
+import argparse
+import json
+import multiprocessing
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from mock_services import MockLLMServer, MockSMTPServer  # noqa: E402
+from litbot_core import DEFAULT_LIMITS  # noqa: E402
+
+SCRIPT = str(ROOT / "streamlit_litbot.py")
+REVIEW = ("소년은 누이가 돌아간 어머니를 닮지 않았다고 생각해서 누이를 미워했다. "
+          "누이가 시집가는 날에도 소년은 숨어 버렸다. 누이가 죽고 나서야 소년은 눈물을 흘렸고, "
+          "누이도 별이 될 수 있다는 걸 깨달았다. 나는 이 장면이 가장 슬펐다.")
+TURNS = [
+    "나는 소년이 누이를 미워하는 게 잘 이해가 안 됐어.",
+    "어머니에 대한 환상 때문에 누이를 제대로 못 본 것 같아.",
+    "마지막에 별이 두 개 떨어지는 장면은 무슨 의미일까?",
+    "누이가 인형을 묻는 장면도 슬펐어.",
+    "결국 소년도 누이를 사랑했던 거 아닐까?",
+]
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else float("nan")
+
+
+class SessionRunner:
+    """학생 한 명의 전체 흐름을 AppTest로 진행하며 단계별 시간을 기록"""
+
+    def __init__(self, index, secrets, turns, timeout):
+        self.index = index
+        self.secrets = secrets
+        self.turns = turns
+        self.timeout = timeout
+        self.timings = defaultdict(list)
+        self.error = None
+        self.app = None
+
+    def step(self, name, action):
+        start = time.perf_counter()
+        action()
+        self.app.run(timeout=self.timeout)
+        self.timings[name].append(time.perf_counter() - start)
+        if self.app.exception:
+            raise RuntimeError(f"{name}: {self.app.exception[0].message}")
+
+    def run(self):
+        try:
+            self.app = AppTest.from_file(SCRIPT, default_timeout=self.timeout)
+            for key, value in self.secrets.items():
+                self.app.secrets[key] = value
+            app = self.app
+
+            self.step("page_load", lambda: None)
+            self.step("name_entry", lambda: (app.text_input(key="lastname").input("김"),
+                                             app.text_input(key="firstname").input(f"학생{self.index}"),
+                                             app.text_input(key="student_code").input(f"code{self.index}")))
+            app.radio(key="review_method").set_value("직접 입력").run(timeout=self.timeout)
+            app.text_area(key="review_text").input(REVIEW).run(timeout=self.timeout)
+            # 제출 버튼을 누른 실행에서 첫 질문까지 생성됨
+            self.step("review_submit+opening", lambda: app.button[0].click())
+            for turn in range(self.turns):
+                self.step("chat_turn", lambda: app.chat_input[0].set_value(TURNS[turn % len(TURNS)]))
+            self.step("eight_min_prompt", lambda: app.session_state.__setitem__("start_time", time.time() - 481))
+            self.step("close_out", lambda: app.session_state.__setitem__("start_time", time.time() - 601))
+            app.radio(key="reflection_method").set_value("직접 입력").run(timeout=self.timeout)
+            app.text_area(key="reflection_text").input("오늘 토론으로 누이를 다르게 보게 됐다.").run(timeout=self.timeout)
+            self.step("reflection", lambda: app.button[0].click())
+        except Exception as e:  # 실패한 세션도 결과에 남김
+            self.error = f"{type(e).__name__}: {e}"
+        return self
+
+
+def session_secrets(secrets, workdir, index, sessions):
+    """세션 프로세스 하나의 secrets: 파일은 세션별 폴더에, LLM 한도는 반 전체 한도를 세션 수로 나눈 몫"""
+    folder = Path(workdir) / f"session{index:03d}"
+    return {
+        **secrets,
+        "email": {**secrets["email"], "outbox_dir": str(folder / "outbox")},
+        "sessions": {"path": str(folder / "sessions.sqlite3")},
+        "telemetry": {"path": str(folder / "events.jsonl")},
+        "limits": {name: {key: value / sessions for key, value in limits.items()}
+                   for name, limits in DEFAULT_LIMITS.items()},
+    }
+
+
+def run_session(index, secrets, turns, timeout, start_line, results):
+    """(자식 프로세스) 학생 한 명의 흐름을 돌리고 단계별 시간·오류·메모리를 results 큐에 넣음"""
+    runner = SessionRunner(index, secrets, turns, timeout)
+    try:
+        start_line.wait(timeout=300)  # 모든 세션 프로세스가 import를 마치면 함께 시작
+    except threading.BrokenBarrierError:
+        runner.error = "다른 세션 프로세스가 시작하지 못함"
+    memory = 0
+    if runner.error is None:
+        tracemalloc.start()
+        runner.run()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    # 발송 스레드는 이 프로세스와 함께 끝나므로 발송함이 빌 때까지 잠시 기다림
+    pending_dir = Path(secrets["email"]["outbox_dir"]) / "pending"
+    deadline = time.time() + 30
+    while any(pending_dir.glob("*.eml")) and time.time() < deadline:
+        time.sleep(0.2)
+    results.put({"index": index, "timings": dict(runner.timings), "error": runner.error, "memory": memory})
+
+
+def run_sessions(args, secrets, workdir):
+    """세션마다 프로세스를 띄워 동시에 진행하고 (결과 목록, 출발부터 끝까지 걸린 초)를 반환"""
+    context = multiprocessing.get_context("spawn")  # 대역 서버 스레드가 도는 부모를 fork하지 않음
+    start_line = context.Barrier(args.sessions + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(target=run_session, daemon=True,
+                        args=(i, session_secrets(secrets, workdir, i, args.sessions), args.turns, args.timeout,
+                              start_line, results))
+        for i in range(args.sessions)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        start_line.wait(timeout=300)
+    except threading.BrokenBarrierError:
+        pass  # 먼저 죽은 프로세스가 있으면 나머지도 오류를 넣고 끝남
+    started = time.perf_counter()
+    collected = {}
+    while len(collected) < args.sessions:
+        try:
+            result = results.get(timeout=1)
+            collected[result["index"]] = result
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                break
+    wall = time.perf_counter() - started
+    for process in processes:
+        process.join(timeout=5)
+    for i, process in enumerate(processes):
+        if i not in collected:
+            collected[i] = {"index": i, "timings": {}, "memory": 0,
+                            "error": f"세션 프로세스가 결과 없이 끝남 (exit code {process.exitcode})"}
+    return [collected[i] for i in range(args.sessions)], wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=30, help="동시 학생 수")
+    parser.add_argument("--turns", type=int, default=5, help="학생당 대화 턴 수")
+    parser.add_argument("--latency", type=float, default=0.8, help="LLM 대역 서버 평균 지연(초)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="LLM 지연 표준편차(초)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="LLM 오류 응답 비율 (0~1)")
+    parser.add_argument("--smtp-latency", type=float, default=0.1, help="메일 한 통 수신 지연(초)")
+    parser.add_argument("--timeout", type=float, default=120, help="스크립트 실행 한 번의 제한 시간(초)")
+    parser.add_argument("--json", help="결과를 JSON으로도 저장할 경로")
+    args = parser.parse_args()
+
+    llm = MockLLMServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate).start()
+    smtp = MockSMTPServer(latency=args.smtp_latency).start()
+    outbox_dir = tempfile.mkdtemp(prefix="litbot-outbox-")
+    secrets = {
+        "claude": {"api_key": "mock", "base_url": llm.base_url},
+        "openai": {"api_key": "mock", "base_url": llm.base_url + "/v1"},
+        "email": {"user": "litbot@example.com", "password": "mock", "smtp_host": "127.0.0.1",
+                  "smtp_port": smtp.port, "smtp_ssl": False, "outbox_dir": outbox_dir},
+    }
+
+    results, wall = run_sessions(args, secrets, outbox_dir)
+    memory_per_session = statistics.fmean(r["memory"] for r in results)
+
+    # 세션 프로세스가 각자의 발송함을 비우고 끝남 (세션당 감상문·대화기록·성찰일지 3통)
+    expected_mail = 3 * sum(1 for r in results if r["error"] is None)
+
+    steps = defaultdict(list)
+    for result in results:
+        for name, samples in result["timings"].items():
+            steps[name].extend(samples)
+    failures = [(r["index"], r["error"]) for r in results if r["error"]]
+
+    print(f"세션 {args.sessions}개 × 턴 {args.turns}개, LLM 지연 {args.latency}±{args.jitter}초, 오류율 {args.error_rate:.0%}")
+    print(f"{'단계':<24}{'횟수':>6}{'p50(s)':>9}{'p95(s)':>9}{'p99(s)':>9}{'최대(s)':>9}")
+    for name, samples in steps.items():
+        print(f"{name:<24}{len(samples):>6}{percentile(samples, 0.5):>9.2f}{percentile(samples, 0.95):>9.2f}"
+              f"{percentile(samples, 0.99):>9.2f}{max(samples):>9.2f}")
+    total_steps = sum(len(s) for s in steps.values())
+    print(f"\n전체 {wall:.1f}초, 처리량 {total_steps / wall:.2f} 단계/초, 완료 세션 {args.sessions - len(failures)}/{args.sessions}")
+    print(f"세션당 메모리 약 {memory_per_session / 1024 / 1024:.2f}MB (세션 프로세스의 tracemalloc 기준, import 제외)")
+    print(f"LLM 요청 {llm.requests}, 수신 메일 {len(smtp.messages)}/{expected_mail}")
+    for index, error in failures[:10]:
+        print(f"  세션 {index} 실패: {error}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "args": vars(args),
+            "wall_seconds": wall,
+            "throughput_steps_per_second": total_steps / wall,
+            "memory_per_session_bytes": memory_per_session,
+            "steps": {name: {"count": len(s), "p50": percentile(s, 0.5), "p95": percentile(s, 0.95),
+                             "p99": percentile(s, 0.99), "mean": statistics.fmean(s)} for name, s in steps.items()},
+            "llm_requests": llm.requests,
+            "mail_received": len(smtp.messages),
+            "failures": failures,
+        }, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    llm.stop()
+    smtp.stop()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""부하 테스트용 로컬 대역 서버: Anthropic/OpenAI 호환 LLM API와 SMTP
+
+지연 시간(latency ± jitter)과 오류 비율(error_rate)을 설정할 수 있음.
+"""
+import argparse
+import json
+import random
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = "나는 그 장면에서 누이가 끝까지 소년을 챙기는 게 더 마음에 남았어. 너는 왜 그 부분이 인상적이었어?"
+
+
+class MockLLMServer:
+    """/v1/messages(Anthropic)와 /v1/chat/completions(OpenAI)를 흉내 내는 HTTP 서버"""
+
+    def __init__(self, latency=0.5, jitter=0.2, error_rate=0.0, chunk_delay=0.02, reply=REPLY, port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chunk_delay = chunk_delay
+        self.reply = reply
+        self.requests = {"anthropic": 0, "openai": 0, "errors": 0}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.make_handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="mock-llm", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, key):
+        with self.lock:
+            self.requests[key] += 1
+
+    def chunks(self):
+        words = self.reply.split(" ")
+        return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+    def make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, body):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def start_sse(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+            def send_event(self, payload, event=None):
+                prefix = f"event: {event}\n" if event else ""
+                self.wfile.write(f"{prefix}data: {payload}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                provider = "anthropic" if self.path.endswith("/v1/messages") else "openai"
+                mock.count(provider)
+                time.sleep(max(0.0, random.gauss(mock.latency, mock.jitter)))
+                if random.random() < mock.error_rate:
+                    mock.count("errors")
+                    self.send_json(529 if provider == "anthropic" else 500,
+                                   {"error": {"type": "overloaded_error", "message": "mock overload"}})
+                    return
+                if provider == "anthropic":
+                    self.anthropic(body)
+                else:
+                    self.openai(body)
+
+            def anthropic(self, body):
+                usage = {"input_tokens": 1200, "cache_read_input_tokens": 8000, "cache_creation_input_tokens": 0}
+                if not body.get("stream"):
+                    self.send_json(200, {"content": [{"type": "text", "text": mock.reply}],
+                                         "usage": {**usage, "output_tokens": 60}})
+                    return
+                self.start_sse()
+                self.send_event(json.dumps({"type": "message_start", "message": {"usage": usage}}), "message_start")
+                for chunk in mock.chunks():
+                    time.sleep(mock.chunk_delay)
+                    self.send_event(json.dumps({"type": "content_block_delta", "index": 0,
+                                                "delta": {"type": "text_delta", "text": chunk}}, ensure_ascii=False),
+                                    "content_block_delta")
+                self.send_event(json.dumps({"type": "message_delta", "usage": {"output_tokens": 60}}), "message_delta")
+                self.send_event(json.dumps({"type": "message_stop"}), "message_stop")
+
+            def openai(self, body):
+                base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": body.get("model", "gpt-4o")}
+                if not body.get("stream"):
+                    self.send_json(200, {**base, "object": "chat.completion",
+                                         "choices": [{"index": 0, "finish_reason": "stop",
+                                                      "message": {"role": "assistant", "content": mock.reply}}],
+                                         "usage": {"prompt_tokens": 9000, "completion_tokens": 60, "total_tokens": 9060}})
+                    return
+                self.start_sse()
+                for chunk in mock.chunks():
+                    time.sleep(mock.chunk_delay)
+                    self.send_event(json.dumps({**base, "object": "chat.completion.chunk",
+                                                "choices": [{"index": 0, "delta": {"content": chunk},
+                                                             "finish_reason": None}]}, ensure_ascii=False))
+                if body.get("stream_options", {}).get("include_usage"):
+                    self.send_event(json.dumps({**base, "object": "chat.completion.chunk", "choices": [],
+                                                "usage": {"prompt_tokens": 9000, "completion_tokens": 60,
+                                                          "total_tokens": 9060,
+                                                          "prompt_tokens_details": {"cached_tokens": 8000}}}))
+                self.send_event("[DONE]")
+
+        return Handler
+
+
+class MockSMTPServer:
+    """로그인(AUTH PLAIN)과 메일 수신만 흉내 내는 평문 SMTP 서버"""
+
+    def __init__(self, latency=0.0, port=0):
+        self.latency = latency
+        self.messages = []
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", port), self.make_handler())
+        self.server.daemon_threads = True
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="mock-smtp", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_handler(self):
+        mock = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode("ascii") + b"\r\n")
+
+            def handle(self):
+                self.reply("220 mock smtp")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.strip().upper()
+                    if command.startswith(b"EHLO"):
+                        self.wfile.write(b"250-mock\r\n250 AUTH PLAIN\r\n")
+                    elif command.startswith(b"AUTH"):
+                        self.reply("235 authenticated")
+                    elif command.startswith(b"DATA"):
+                        self.reply("354 end with .")
+                        data = []
+                        while True:
+                            line = self.rfile.readline()
+                            if not line or line == b".\r\n":
+                                break
+                            data.append(line)
+                        time.sleep(mock.latency)
+                        with mock.lock:
+                            mock.messages.append(b"".join(data))
+                        self.reply("250 queued")
+                    elif command.startswith(b"QUIT"):
+                        self.reply("221 bye")
+                        return
+                    else:
+                        self.reply("250 ok")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="로컬 LLM 대역 서버만 따로 띄움 (배치 모드 시험 등)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="평균 지연(초)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="지연 표준편차(초)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="오류 응답 비율 (0~1)")
+    args = parser.parse_args()
+
+    llm = MockLLMServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, port=args.port).start()
+    print(f"LLM 대역 서버: {llm.base_url} (Claude) / {llm.base_url}/v1 (OpenAI), Ctrl+C로 종료")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        llm.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""키워드 분류기: keywords.json의 모든 카테고리를 한 번의 순회로 찾음"""
+import json
+import re
+from collections import defaultdict
+from pathlib import Path
+
+KEYWORDS_PATH = Path(__file__).parent / "keywords.json"
+
+
+class KeywordMatcher:
+    """여러 키워드를 컴파일된 정규식 하나로 찾음 (겹치는 키워드도 모두 찾음)
+
+    긴 키워드부터 나열한 정규식(finditer)으로 겹치지 않는 적중을 찾고, 같은 위치에서 시작하는 더 짧은
+    키워드(= 가장 긴 키워드의 접두사)는 미리 계산해 둔 목록으로 채움.
+    적중 안쪽에서 다른 키워드가 시작할 수 있는 위치("누이" 안의 "이" -> "이야기")만 따로 match로 확인함
+    """
+
+    def __init__(self, patterns):
+        # patterns: (키워드, 붙일 값) 목록
+        payloads = defaultdict(list)
+        for keyword, payload in patterns:
+            payloads[keyword].append(payload)
+        keywords = sorted(payloads, key=len, reverse=True)
+        self.regex = re.compile("|".join(map(re.escape, keywords))) if keywords else None
+        # 가장 긴 키워드 -> 같은 위치에서 함께 적중하는 (키워드, 붙인 값) 목록
+        self.expansions = {
+            k: [(p, payload) for p in keywords if k.startswith(p) for payload in payloads[p]] for k in keywords
+        }
+        # 가장 긴 키워드 -> 그 안에서 다른 키워드가 시작할 수 있는 상대 위치 (대부분 빈 목록)
+        self.inner_offsets = {
+            k: [o for o in range(1, len(k)) if any(j.startswith(k[o:]) or k.startswith(j, o) for j in keywords)]
+            for k in keywords
+        }
+
+    def find_all(self, text):
+        """(시작 위치, 키워드, 붙인 값)을 등장 순서대로 반환"""
+        hits = []
+        if self.regex is None:
+            return hits
+        append = hits.append
+        expansions = self.expansions
+        inner_offsets = self.inner_offsets
+        match_at = self.regex.match
+        for match in self.regex.finditer(text):
+            start = match.start()
+            keyword = match.group()
+            for item in expansions[keyword]:
+                append((start,) + item)
+            for offset in inner_offsets[keyword]:
+                inner = match_at(text, start + offset)
+                if inner is not None:
+                    for item in expansions[inner.group()]:
+                        append((start + offset,) + item)
+        return hits
+
+
+class KeywordClassifier:
+    """카테고리별 키워드 적중을 한 번에 분류 (욕설, 문맥 의존 표현, 소설/딴 주제 단어, 감상문 주제)"""
+
+    def __init__(self, categories):
+        self.categories = categories
+        patterns = []
+        for keyword in categories["profanity"]:
+            patterns.append((keyword, ("profanity", keyword)))
+        for main_word, triggers in categories["context_sensitive"].items():
+            patterns.append((main_word, ("context_main", main_word)))
+            for trigger in triggers:
+                patterns.append((trigger, ("context_trigger", trigger)))
+        for keyword in categories["novel_terms"]:
+            patterns.append((keyword, ("novel_terms", keyword)))
+        for keyword in categories["off_topic_terms"]:
+            patterns.append((keyword, ("off_topic_terms", keyword)))
+        for topic, keywords in categories["review_topics"].items():
+            for keyword in keywords:
+                patterns.append((keyword, ("review_topics", topic)))
+        self.matcher = KeywordMatcher(patterns)
+
+    def classify(self, text):
+        """{카테고리: [(위치, 키워드, 라벨), ...]} 형태로 모든 적중 반환"""
+        hits = {name: [] for name in ["profanity", "context_main", "context_trigger",
+                                      "novel_terms", "off_topic_terms", "review_topics"]}
+        for start, keyword, (category, label) in self.matcher.find_all(text):
+            hits[category].append((start, keyword, label))
+        return hits
+
+    def find_profanity(self, hits):
+        """적중한 욕설 중 keywords.json 목록에서 가장 앞선 것, 없으면 None (예전 검사와 같은 순서)"""
+        found = {label for _, _, label in hits["profanity"]}
+        return next((keyword for keyword in self.categories["profanity"] if keyword in found), None)
+
+    def find_inappropriate(self, hits):
+        """부적절한 표현을 찾으면 그 표현, 없으면 None
+
+        문장 속 위치가 아니라 keywords.json 순서로 골라서 피드백에 나오는 표현이 예전과 같음
+        """
+        profanity = self.find_profanity(hits)
+        if profanity:
+            return profanity
+        found_mains = {label for _, _, label in hits["context_main"]}
+        found_triggers = {label for _, _, label in hits["context_trigger"]}
+        for main_word, triggers in self.categories["context_sensitive"].items():
+            if main_word not in found_mains:
+                continue
+            for trigger in triggers:
+                if trigger in found_triggers:
+                    return main_word + " " + trigger
+        return None
+
+    @staticmethod
+    def topics(hits):
+        """적중한 감상문 주제 이름 집합"""
+        return {label for _, _, label in hits["review_topics"]}
+
+
+def load_keyword_classifier(path=KEYWORDS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return KeywordClassifier(json.load(f))
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""감상문 일괄 준비 (배치 모드): 수업 전에 반 전체 감상문의 첫 질문과 주제 분석을 미리 만들어 둠
+
+    python litbot_batch.py reviews/ [--workers 8] [--report report.csv]
+
+폴더 안의 .txt/.pdf 감상문마다 라이브 세션과 같은 프롬프트로 첫 질문을 만들고, 감상문 주제와 함께
+세션 저장소(prepared 테이블)에 저장함. 학생이 같은 이름·같은 감상문으로 들어오고 프롬프트가 배치 때와 같으면
+LLM을 부르지 않고 저장된 첫 질문으로 바로 시작함. 마지막 질문은 대화에서 다룬 주제에 따라 달라져서 미리 만들지 않음.
+
+파일 이름은 앱이 보내는 메일 첨부와 같은 "<이름>_감상문.txt" 형식이어야 함 ("_" 앞부분을 학생 이름으로 씀).
+API 키와 한도는 .streamlit/secrets.toml에서 읽고, 로컬 대역 서버로 시험할 때는 주소만 바꿔 끼움:
+
+    python benchmarks/mock_services.py --port 8765 &
+    python litbot_batch.py reviews/ --claude-base-url http://127.0.0.1:8765 --openai-base-url http://127.0.0.1:8765/v1
+"""
+import argparse
+import csv
+import sys
+import time
+import tomllib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from keyword_matcher import load_keyword_classifier
+from litbot_core import (
+    BACKUP_SUMMARY, OPENING_INSTRUCTIONS, OPENING_REQUEST, PromptBuilder,
+    admission_request, call_with_fallback, claude_complete, create_admission_scheduler, create_llm_providers,
+    gpt_complete,
+    load_novel_artifacts, ordered_review_topics, response_cache_key,
+)
+from review_pdf import PdfExtractionError, extract_pdf_text
+from session_store import SESSION_DB_PATH, SessionStore, prepared_key
+
+SECRETS_PATH = Path(__file__).parent / ".streamlit" / "secrets.toml"
+REPORT_FIELDS = ["file", "name", "status", "provider", "seconds", "review_topics", "opening", "error"]
+
+
+def student_name(path):
+    """파일 이름에서 학생 이름을 꺼냄 ("민수_감상문.txt" → "민수", 앱이 메일 첨부에 붙이는 이름 규칙)"""
+    return path.stem.split("_")[0].strip()
+
+
+def read_review(path, pdf_timeout):
+    content = path.read_bytes()
+    if path.suffix.lower() == ".pdf":
+        return extract_pdf_text(content, timeout=pdf_timeout)["text"]
+    return content.decode("utf-8")  # 라이브 업로드와 같은 방식으로 읽어야 같은 키가 나옴
+
+
+class BatchPreparer:
+    """감상문 하나씩 첫 질문을 만들어 저장 (여러 작업 스레드가 함께 씀)"""
+
+    def __init__(self, secrets, store, force=False, pdf_timeout=15):
+        novel = load_novel_artifacts(secrets.get("novel", {}).get("refresh_from_github", False))
+        self.builder = PromptBuilder(novel["text"] if novel else BACKUP_SUMMARY)
+        self.classifier = load_keyword_classifier()
+        self.providers = create_llm_providers(secrets, max_workers=32, hedge=False)
+        # 라이브 서버와는 다른 프로세스라 한도를 나눠 쓰지 않으므로, 수업 중에 돌릴 거면 [limits]를 낮춰서 줄 것
+        self.scheduler = create_admission_scheduler(secrets)
+        self.store = store
+        self.force = force
+        self.pdf_timeout = pdf_timeout
+
+    def prepare(self, path):
+        start = time.perf_counter()
+        row = {"file": path.name, "name": student_name(path), "status": "ok"}
+        try:
+            review = read_review(path, self.pdf_timeout)
+            if not review.strip():
+                raise PdfExtractionError("감상문에서 글자를 찾지 못했어요.")
+            topics = ordered_review_topics(self.classifier, review)
+            row["review_topics"] = " ".join(topics)
+
+            history = [{"role": "user", "content": OPENING_REQUEST}]
+            system_prompt = self.builder.system_blocks(row["name"], review, OPENING_INSTRUCTIONS, query=review)
+            prompt_hash = response_cache_key(history, system_prompt)
+            key = prepared_key(row["name"], review)
+            existing = self.store.load_prepared(key)
+            if existing and existing["prompt_hash"] == prompt_hash and not self.force:
+                row.update(status="skipped", opening=existing["opening"])
+                return row
+
+            providers = self.providers
+            opening, row["provider"] = call_with_fallback(
+                (providers["claude"], lambda: claude_complete(providers["claude"], history, system_prompt, {})),
+                (providers["gpt"], lambda: gpt_complete(providers["gpt"], history, system_prompt)),
+                providers["executor"],
+                admission=admission_request(self.scheduler, history, system_prompt, "opening", row["name"]),
+            )
+            row["opening"] = opening.strip()
+            self.store.save_prepared(key, row["name"], path.name, prompt_hash, row["opening"], topics)
+        except Exception as e:  # 실패한 감상문도 결과표에 남김
+            row.update(status="failed", error=str(e)[:300])
+        finally:
+            row["seconds"] = round(time.perf_counter() - start, 2)
+        return row
+
+
+def load_secrets(args):
+    secrets = tomllib.loads(Path(args.secrets).read_text(encoding="utf-8")) if Path(args.secrets).exists() else {}
+    for provider, base_url in [("claude", args.claude_base_url), ("openai", args.openai_base_url)]:
+        section = secrets.setdefault(provider, {})
+        if base_url:
+            section["base_url"] = base_url
+            section.setdefault("api_key", "mock")
+        if "api_key" not in section:
+            raise SystemExit(f"{args.secrets}에 [{provider}] api_key가 없어요.")
+    return secrets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder", help="감상문(.txt/.pdf) 폴더")
+    parser.add_argument("--workers", type=int, default=8, help="동시에 처리할 감상문 수")
+    parser.add_argument("--secrets", default=str(SECRETS_PATH), help="secrets.toml 경로")
+    parser.add_argument("--db", help="세션 DB 경로 (기본: secrets의 [sessions] path 또는 sessions/sessions.sqlite3)")
+    parser.add_argument("--report", help="결과를 CSV로 저장할 경로 (교사 확인용)")
+    parser.add_argument("--force", action="store_true", help="이미 만든 첫 질문도 다시 만듦")
+    parser.add_argument("--pdf-timeout", type=float, default=15, help="PDF 한 개를 읽는 제한 시간(초)")
+    parser.add_argument("--claude-base-url", help="Claude API 주소 (로컬 대역 서버 시험용)")
+    parser.add_argument("--openai-base-url", help="OpenAI API 주소 (로컬 대역 서버 시험용)")
+    args = parser.parse_args()
+
+    secrets = load_secrets(args)
+    paths = sorted(p for p in Path(args.folder).iterdir() if p.suffix.lower() in [".txt", ".pdf"])
+    if not paths:
+        print(f"{args.folder}에 .txt/.pdf 감상문이 없어요.")
+        return 1
+
+    store = SessionStore(args.db or secrets.get("sessions", {}).get("path", SESSION_DB_PATH))
+    preparer = BatchPreparer(secrets, store, force=args.force, pdf_timeout=args.pdf_timeout)
+    started = time.perf_counter()
+    rows = []
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="batch") as pool:
+        for future in as_completed([pool.submit(preparer.prepare, path) for path in paths]):
+            row = future.result()
+            rows.append(row)
+            print(f"[{len(rows)}/{len(paths)}] {row['file']}: {row['status']} ({row['seconds']}초)"
+                  + (f" - {row['error']}" if row.get("error") else ""))
+    wall = time.perf_counter() - started
+
+    counts = {status: sum(1 for r in rows if r["status"] == status) for status in ["ok", "skipped", "failed"]}
+    print(f"\n완료 {counts['ok']}, 건너뜀 {counts['skipped']}, 실패 {counts['failed']} / {len(paths)}개, "
+          f"{wall:.1f}초 ({len(paths) / wall:.2f}개/초)")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8-sig", newline="") as f:  # 엑셀에서 한글이 깨지지 않도록 BOM
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(sorted(rows, key=lambda r: r["file"]))
+        print(f"결과표: {args.report}")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1220 @@
+# -*- coding: utf-8 -*-
+"""리토 앱 핵심 로직: Streamlit 없이 import할 수 있는 클래스와 함수
+
+Streamlit은 상호작용마다 streamlit_litbot.py를 처음부터 다시 실행하지만 이 모듈은 프로세스당 한 번만
+import됨. 무거운 의존성(openai, requests, smtplib, email)은 실제로 쓰는 함수 안에서 import함.
+"""
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+
+TELEMETRY_PATH = Path(__file__).parent / "telemetry" / "events.jsonl"
+
+def start_batch_writer(name, items, write_batch, flush_interval, batch_size=None):
+    """백그라운드 스레드가 items 큐에 쌓인 항목을 잠깐씩 모아 write_batch(batch)로 한 번에 씀"""
+    def run():
+        while True:
+            batch = [items.get()]
+            time.sleep(flush_interval)  # 잠깐 모아서 한 번에 씀
+            while (batch_size is None or len(batch) < batch_size) and not items.empty():
+                batch.append(items.get())
+            write_batch(batch)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+
+class TelemetrySink:
+    """구조화된 성능 이벤트를 메모리 큐에 넣고, 백그라운드 스레드가 JSONL 파일에 묶어서 씀
+
+    emit()은 딕셔너리 하나를 큐에 넣고 집계값만 갱신하므로 운영 중에 켜 둬도 부담이 작음.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.errors = Counter()
+        self.durations = defaultdict(lambda: deque(maxlen=1000))
+        self.tokens = Counter()
+        start_batch_writer("telemetry", self.queue, self.write_batch, flush_interval)
+
+    def emit(self, event, **fields):
+        record = {"ts": round(time.time(), 3), "event": event, **fields}
+        self.queue.put(record)
+        with self.lock:
+            self.counts[event] += 1
+            if fields.get("error"):
+                self.errors[event] += 1
+            if "ms" in fields:
+                self.durations[event].append(fields["ms"])
+            for key in ["input_tokens", "output_tokens", "cache_hit_tokens", "cache_miss_tokens"]:
+                self.tokens[key] += fields.get(key) or 0
+            if fields.get("fallback"):
+                self.counts["llm_fallback"] += 1
+
+    def write_batch(self, batch):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in batch))
+        except OSError:
+            pass  # 기록 실패가 수업을 막으면 안 됨
+
+    def summary(self):
+        """운영자 화면용 이벤트별 횟수·오류·지연 시간 요약"""
+        with self.lock:
+            rows = []
+            for event, count in sorted(self.counts.items()):
+                samples = sorted(self.durations.get(event, []))
+                rows.append({
+                    "event": event,
+                    "count": count,
+                    "errors": self.errors[event],
+                    "p50_ms": samples[len(samples) // 2] if samples else None,
+                    "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] if samples else None,
+                })
+            return rows, dict(self.tokens)
+
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+RETRIEVAL_TOP_K = 6               # 한 번에 넣을 최대 장면 수
+RETRIEVAL_TOKEN_BUDGET = 2500     # 턴마다 바뀌는 발췌문 토큰 예산
+RETRIEVAL_STABLE_TOKENS = 1200    # 감상문 관련 고정 발췌 토큰 (캐시 블록 최소 크기 1024 토큰을 넘기도록)
+RETRIEVAL_MIN_CONFIDENCE = 0.3    # 이보다 낮으면 소설 전문 사용
+
+def estimate_tokens(text):
+    """로컬 토큰 수 추정 (한국어 기준 보정)
+
+    한글 음절은 거의 1토큰씩, 영문·숫자는 4글자당 1토큰, 공백·문장부호는 2글자당 1토큰 정도로 셈
+    """
+    hangul = len(re.findall(r"[가-힣ㄱ-ㅎㅏ-ㅣ]", text))
+    alnum = len(re.findall(r"[A-Za-z0-9]", text))
+    return hangul + alnum // 4 + (len(text) - hangul - alnum) // 2
+
+def split_passages(text, max_chars=400):
+    """소설을 문단 단위로 나누고, 긴 문단은 문장 경계에서 다시 자름"""
+    passages = []
+    for paragraph in text.splitlines():
+        paragraph = paragraph.strip()
+        if len(paragraph) < 20:  # 제목, 작가명 등
+            continue
+        chunk = ""
+        for sentence in re.split(r"(?<=[.?!])\s+", paragraph):
+            if chunk and len(chunk) + len(sentence) > max_chars:
+                passages.append(chunk)
+                chunk = ""
+            chunk = f"{chunk} {sentence}".strip()
+        if chunk:
+            passages.append(chunk)
+    return passages
+
+def char_ngrams(text, n=2):
+    """공백·문장부호를 뺀 글자 n-gram (한국어 조사 변화에 강함)"""
+    text = re.sub(r"[^가-힣a-zA-Z0-9]", "", text)
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+def build_passage_index(text, k1=1.5, b=0.75):
+    """글자 bigram 기반 BM25 색인 생성"""
+    passages = split_passages(text)
+    term_freqs = [Counter(char_ngrams(p)) for p in passages]
+    doc_freq = Counter(term for tf in term_freqs for term in tf)
+    n = len(passages)
+    return {
+        "passages": passages,
+        "term_freqs": term_freqs,
+        "lengths": [sum(tf.values()) for tf in term_freqs],
+        "idf": {t: math.log(1 + (n - df + 0.5) / (df + 0.5)) for t, df in doc_freq.items()},
+        "avg_len": sum(sum(tf.values()) for tf in term_freqs) / max(n, 1),
+        "k1": k1,
+        "b": b,
+    }
+
+def search_passages(index, query):
+    """질의와 관련된 장면 번호를 BM25 점수 순으로 반환"""
+    query_terms = set(char_ngrams(query)) & index["idf"].keys()
+    k1, b = index["k1"], index["b"]
+    ranked = []
+    for i, tf in enumerate(index["term_freqs"]):
+        length_norm = k1 * (1 - b + b * index["lengths"][i] / index["avg_len"])
+        score = sum(index["idf"][t] * tf[t] * (k1 + 1) / (tf[t] + length_norm) for t in query_terms if t in tf)
+        if score > 0:
+            ranked.append((score, i))
+    ranked.sort(reverse=True)
+    return [i for _, i in ranked]
+
+def review_passages(index, review_content, token_budget=RETRIEVAL_STABLE_TOKENS):
+    """감상문 관련 장면을 token_budget을 넘을 때까지 고름 (모자라면 소설 앞부분부터 채움)
+
+    같은 감상문이면 항상 같은 장면이 나와서 세션 내내 캐시 접두부가 바뀌지 않음
+    """
+    chosen, used = [], 0
+    for i in search_passages(index, review_content) + list(range(len(index["passages"]))):
+        if used >= token_budget:
+            break
+        if i not in chosen:
+            chosen.append(i)
+            used += estimate_tokens(index["passages"][i])
+    return sorted(chosen)
+
+def select_passages(index, user_message, stable=(), top_k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET):
+    """사용자 메시지 관련 장면 중 고정 발췌(stable)에 없는 것을 예산 안에서 골라 반환
+
+    추가할 장면이 없으면 빈 문자열, 고정 발췌와 합쳐도 확신이 낮으면 None 반환
+    """
+    chosen, used = [], 0
+    for i in search_passages(index, user_message)[:top_k]:
+        cost = estimate_tokens(index["passages"][i])
+        if i in stable or used + cost > token_budget:
+            continue
+        chosen.append(i)
+        used += cost
+
+    # 확신도: 메시지의 글자 bigram(idf 가중) 중 모델이 보게 될 장면에 실제로 나오는 비율
+    message_terms = set(char_ngrams(user_message))
+    shown = list(stable) + chosen
+    if not shown or not message_terms:
+        return None
+    covered = set().union(*(index["term_freqs"][i].keys() for i in shown))
+    unknown_idf = max(index["idf"].values())
+    total = sum(index["idf"].get(t, unknown_idf) for t in message_terms)
+    confidence = sum(index["idf"][t] for t in message_terms & covered) / total
+    if confidence < RETRIEVAL_MIN_CONFIDENCE:
+        return None
+
+    return "\n...\n".join(index["passages"][i] for i in sorted(chosen))
+
+# 소설 전문은 저장소의 novel_star.txt를 우선 사용 (GitHub에서 새로 받는 건 선택 사항)
+NOVEL_PATH = Path(__file__).parent / "novel_star.txt"
+NOVEL_URL = "https://raw.githubusercontent.com/mveishu/star/main/novel_star.txt"
+ARTIFACT_DIR = Path(__file__).parent / ".litbot_cache"
+
+def normalize_novel_text(text):
+    """BOM·줄바꿈·유니코드 정규화(NFC), 줄 끝 공백 제거"""
+    text = unicodedata.normalize("NFC", text.lstrip("\ufeff").replace("\r\n", "\n"))
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+def compute_novel_artifacts(raw_text):
+    """정규화된 본문, 문단 위치, 내용 해시, 예상 토큰 수를 한 번에 계산"""
+    text = normalize_novel_text(raw_text)
+    paragraph_offsets = []
+    position = 0
+    for line in text.split("\n"):
+        if line.strip():
+            paragraph_offsets.append([position, position + len(line)])
+        position += len(line) + 1
+    return {
+        "text": text,
+        "content_hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        "paragraph_offsets": paragraph_offsets,
+        "estimated_tokens": estimate_tokens(text),
+    }
+
+def fetch_novel_from_github(timeout=5):
+    """GitHub에서 최신 본문을 받아옴 (실패하면 None)"""
+    import requests
+    try:
+        response = requests.get(NOVEL_URL, timeout=timeout)
+        response.encoding = 'utf-8'
+        if response.status_code == 200:
+            return response.text
+    except requests.RequestException:
+        pass
+    return None
+
+def load_novel_artifacts(refresh_from_github=False):
+    """소설 본문과 미리 계산한 부가 정보 로딩 (네트워크 없이 시작)
+
+    같은 본문의 계산 결과는 .litbot_cache/에 저장해서 재시작할 때 다시 쓰고,
+    refresh_from_github=True일 때만 GitHub 본문으로 갱신함
+    """
+    raw_text = NOVEL_PATH.read_text(encoding="utf-8") if NOVEL_PATH.exists() else None
+    if refresh_from_github:
+        raw_text = fetch_novel_from_github() or raw_text
+    if not raw_text:
+        return None
+
+    raw_hash = hashlib.sha256(raw_text.encode("utf-8")).hexdigest()
+    cache_path = ARTIFACT_DIR / f"novel_{raw_hash[:16]}.json"
+    if cache_path.exists():
+        try:
+            return json.loads(cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            pass  # 깨진 캐시는 다시 계산
+
+    artifacts = compute_novel_artifacts(raw_text)
+    try:
+        ARTIFACT_DIR.mkdir(exist_ok=True)
+        tmp_path = cache_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(artifacts, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # 읽기 전용 배포 환경이면 저장 없이 사용
+    return artifacts
+
+# 소설 전문을 못 읽었을 때 쓰는 백업 요약
+BACKUP_SUMMARY = """
+    이 소설은 아홉 살 소년이 과수 노파로부터 누이가 돌아간 어머니와 닮았다는 말을 듣고 어머니에 대한 환상을 품게 되지만, 누이의 실제 모습에 실망하며 그녀를 거부하고 냉대하는 과정을 그린다. 소년은 누이가 베푸는 어머니 같은 사랑을 인정하지 않으려 하고, 누이의 연애 사건과 결혼, 그리고 죽음에 이르기까지 지속적으로 그녀를 멀리하지만, 결국 누이의 죽음 후에야 눈물을 흘리며 그녀 역시 어머니처럼 아름다운 별이 될 수 있음을 깨닫는다.
+    """
+
+PERSONA_PROMPT = "너는 학생과 함께 소설 <별>을 읽은 동료 학습자야. 같은 책을 읽은 친구처럼 행동해."
+
+# 첫 질문 요청 (라이브 세션과 배치 모드가 같은 프롬프트를 씀)
+OPENING_REQUEST = "감상문을 읽고 사용자와 다른 관점을 제시하면서 자연스럽게 질문해줘. '나는 네가 A부분에서 B에 주목한 게 인상적이었어. 왜냐면 나는 같은 장면에서 C가 더 신경쓰였거든' 같은 방식으로"
+OPENING_INSTRUCTIONS = "감상문에서 언급된 내용에 대해 다른 시각을 제시하면서 자연스럽게 대화를 시작해."
+
+class PromptBuilder:
+    """소설 색인과 소설 전문이 들어간 고정 블록을 한 번만 만들어 두고 턴마다 시스템 프롬프트를 조립"""
+
+    def __init__(self, novel_content):
+        self.passage_index = build_passage_index(novel_content)
+        # 학생 이름이 들어가지 않은 고정 접두부라서 모든 학생·모든 턴이 같은 캐시를 공유함
+        self.novel_block = {"type": "text", "text": f"""{PERSONA_PROMPT}
+작품 전문: {novel_content}""", "cache_control": {"type": "ephemeral"}}
+
+    def system_blocks(self, user_name, review_content, instructions, query=None, history_summary=None):
+        """시스템 프롬프트를 캐시 가능한 블록 순서로 구성 (고정 소설 → 감상문 → 턴별 지시)
+
+        query가 주어지면 소설 전문 대신 감상문 관련 고정 발췌 + 질의 관련 장면만 넣음 (확신이 낮으면 전문 사용)
+        history_summary는 오래된 대화를 접은 요약으로, 캐시 구간 뒤에 붙음
+        """
+        review_block = f"""지금 대화하는 친구의 이름은 {user_name}야.
+{user_name}의 감상문: {review_content}"""
+        turn_blocks = [{"type": "text", "text": instructions}]
+        if history_summary:
+            turn_blocks.insert(0, {"type": "text", "text": f"앞서 나눈 대화 요약: {history_summary}"})
+
+        stable = review_passages(self.passage_index, review_content) if query else []
+        excerpt = select_passages(self.passage_index, query, stable) if query else None
+        if excerpt is not None:
+            # 페르소나·감상문·고정 발췌는 세션 내내 같아서 여기까지 캐시하고, 턴마다 바뀌는 발췌는 그 뒤에 붙임
+            fixed = "\n...\n".join(self.passage_index["passages"][i] for i in stable)
+            blocks = [{"type": "text", "text": f"""{PERSONA_PROMPT}
+{review_block}
+작품 발췌 (감상문과 관련된 장면):
+{fixed}""", "cache_control": {"type": "ephemeral"}}]
+            if excerpt:
+                blocks.append({"type": "text", "text": f"작품 발췌 (대화와 관련된 장면):\n{excerpt}"})
+            return blocks + turn_blocks
+
+        return [
+            self.novel_block,
+            {"type": "text", "text": review_block, "cache_control": {"type": "ephemeral"}},
+        ] + turn_blocks
+
+def ordered_review_topics(classifier, review_content):
+    """감상문에 나온 주제를 keywords.json 순서대로 반환"""
+    found = classifier.topics(classifier.classify(review_content))
+    return [topic for topic in classifier.categories["review_topics"] if topic in found]
+
+def create_final_question(unused_topics, review_content):
+    """미사용 주제를 바탕으로 마지막 질문 생성"""
+    
+    final_questions = {
+        "소년": "네가 감상문에서 소년에 대해 썼는데, 소년의 마음 변화 중에서 가장 중요한 순간이 언제였다고 생각해?",
+        "누이": "감상문에서 누이를 언급했는데, 누이가 소년에게 끝까지 사랑을 베푼 이유가 뭐라고 생각해?",
+        "별": "네가 '별'에 대해 쓴 부분이 인상적이었어. 소설에서 별이 어떤 의미인지 너만의 해석을 들려줄래?",
+        "어머니": "감상문에서 어머니를 언급했는데, 어머니의 부재가 이 가족에게 어떤 영향을 줬다고 봐?",
+        "깨달음": "네가 쓴 '깨달음' 부분이 궁금해. 소년이 마지막에 진짜 깨달은 게 뭐라고 생각해?",
+        "슬픔": "감상문에서 슬픔에 대해 썼는데, 이 소설에서 가장 슬픈 장면이 어디였어?",
+        "가족": "가족 관계에 대한 네 생각이 궁금해. 이 소설이 가족의 의미에 대해 뭘 말하고 있다고 봐?"
+    }
+    
+    if unused_topics:
+        chosen_topic = unused_topics[0]  # 첫 번째 미사용 주제 선택
+        return final_questions.get(chosen_topic, "마지막으로, 이 소설에서 가장 인상 깊었던 부분이 뭐야?")
+    else:
+        return "마지막으로, 이 소설을 읽고 네가 가장 많이 생각하게 된 건 뭐야?"
+
+def system_prompt_to_text(system_prompt):
+    """블록 리스트 형태의 시스템 프롬프트를 GPT용 단일 문자열로 변환"""
+    if isinstance(system_prompt, str):
+        return system_prompt
+    return "\n\n".join(block["text"] for block in system_prompt)
+
+# LLM 호출 설정
+CLAUDE_BASE_URL = "https://api.anthropic.com"
+LLM_CONNECT_TIMEOUT = 3.05    # 연결 시간 제한(초)
+LLM_DEADLINE = 25             # 호출 하나의 전체 마감 시간(초)
+RETRYABLE_STATUS = [429, 500, 503, 408, 529]
+HEDGE_MIN_SAMPLES = 20        # p95를 믿을 만한 최소 표본 수
+
+class ProviderError(Exception):
+    """프로바이더 호출 실패 (retryable=False면 다른 모델로 넘기지 않고 그대로 보여줌)"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+class StreamInterrupted(ProviderError):
+    """첫 조각을 보낸 뒤에 스트림이 끊김 (이미 보여준 답에 다른 모델 답을 이어붙이지 않음)"""
+
+    def __init__(self, message):
+        super().__init__(message, retryable=False)
+
+class CircuitBreaker:
+    """연속 실패가 failure_threshold번 쌓이면 cooldown초 동안 호출을 막음"""
+
+    def __init__(self, failure_threshold=3, cooldown=30):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            # cooldown이 지나면 시험 호출 하나만 통과시킴 (half-open)
+            if time.time() - self.opened_at >= self.cooldown:
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+
+    @property
+    def state(self):
+        return "open" if self.opened_at is not None else "closed"
+
+class ProviderClient:
+    """프로바이더 하나의 연결 풀, 마감 시간, 서킷 브레이커, 지연 시간·오류 카운터
+
+    hedge=True면 p95 안에 답이 없을 때 다른 모델도 동시에 호출함
+    """
+
+    def __init__(self, name, api_key=None, base_url=None, deadline=LLM_DEADLINE, pool_size=32, hedge=False):
+        import requests
+
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url
+        self.deadline = deadline
+        self.hedge = hedge
+        self.openai = None
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.breaker = CircuitBreaker()
+        self.latencies = {"complete": deque(maxlen=500), "first_token": deque(maxlen=500)}
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    def openai_client(self):
+        """OpenAI SDK 클라이언트 (처음 쓸 때 한 번만 import해서 만듦)"""
+        with self.lock:
+            if self.openai is None:
+                from openai import OpenAI
+                self.openai = OpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,  # 로컬 스텁 서버로 바꿔 끼울 수 있음
+                    max_retries=0,  # 재시도 대신 Claude/GPT 간 대체 호출로 처리
+                )
+            return self.openai
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def record_success(self, latency):
+        self.breaker.record_success()
+        with self.lock:
+            self.counters["success"] += 1
+            self.latencies["complete"].append(latency)
+
+    def record_ttft(self, latency):
+        with self.lock:
+            self.latencies["first_token"].append(latency)
+
+    def record_failure(self):
+        self.breaker.record_failure()
+        self.count("error")
+
+    def percentile(self, kind, q):
+        samples = sorted(self.latencies[kind])
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def hedge_after(self, kind):
+        """헤지 호출을 시작할 시점 (p95 지연 시간, 표본이 부족하면 None)"""
+        if not self.hedge or len(self.latencies[kind]) < HEDGE_MIN_SAMPLES:
+            return None
+        return self.percentile(kind, 0.95)
+
+    def stats(self):
+        return {
+            "circuit": self.breaker.state,
+            **self.counters,
+            "p50": self.percentile("complete", 0.5),
+            "p95": self.percentile("complete", 0.95),
+            "ttft_p50": self.percentile("first_token", 0.5),
+            "ttft_p95": self.percentile("first_token", 0.95),
+        }
+
+def create_llm_providers(secrets, max_workers=64, hedge=None):
+    """secrets.toml 형식의 설정으로 프로바이더 클라이언트와 작업 스레드 풀을 만듦 (라이브 앱·배치 모드 공용)
+
+    hedge를 주지 않으면 [llm] hedge 설정을 따름
+    """
+    if hedge is None:
+        hedge = secrets.get("llm", {}).get("hedge", False)  # p95 안에 답이 없으면 GPT-4o도 동시에 호출
+    return {
+        "claude": ProviderClient("claude", secrets["claude"]["api_key"], secrets["claude"].get("base_url"),
+                                 hedge=hedge),
+        "gpt": ProviderClient("gpt", secrets["openai"]["api_key"], secrets["openai"].get("base_url")),
+        "executor": ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm"),
+    }
+
+DEFAULT_LIMITS = {
+    "claude": {"rpm": 50, "itpm": 30000},
+    "gpt": {"rpm": 500, "itpm": 30000},
+}
+ADMISSION_TIMEOUT = 120   # 이보다 오래 기다려야 하면 포기(초)
+
+class AdmissionTimeout(ProviderError):
+    """대기열에서 너무 오래 기다린 요청"""
+
+class TokenBucket:
+    """분당 per_minute만큼 채워지는 토큰 버킷"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """amount를 꺼내려면 기다려야 하는 시간(초)"""
+        self.refill()
+        return max(0.0, (min(amount, self.capacity) - self.tokens) / self.rate)
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+class AdmissionScheduler:
+    """모든 세션이 공유하는 프로바이더별 입장 관리
+
+    요청 수·입력 토큰 버킷이 허락할 때만 호출을 보내고, 대기열은 (우선순위, 세션이 지금까지 받은 횟수,
+    도착 순서)로 정렬해서 대화 턴을 첫 질문·마무리보다 먼저, 덜 받은 세션을 먼저 처리함.
+    """
+
+    PRIORITY = {"turn": 0, "opening": 1, "closing": 1, "background": 2}
+
+    def __init__(self, limits):
+        self.buckets = {name: (TokenBucket(l["rpm"]), TokenBucket(l["itpm"])) for name, l in limits.items()}
+        self.waiting = {name: [] for name in limits}
+        self.served = Counter()
+        self.sequence = itertools.count()
+        self.cond = threading.Condition()
+
+    def estimate_wait(self, provider, entry):
+        """앞에 줄 선 요청까지 모두 처리될 때까지의 예상 대기 시간(초)"""
+        requests_bucket, tokens_bucket = self.buckets[provider]
+        ahead = [e for e in self.waiting[provider] if e <= entry]
+        requests_bucket.refill()
+        tokens_bucket.refill()
+        return max(0.0,
+                   (len(ahead) - requests_bucket.tokens) / requests_bucket.rate,
+                   (sum(e[3] for e in ahead) - tokens_bucket.tokens) / tokens_bucket.rate)
+
+    def try_admit(self, provider, entry, session):
+        requests_bucket, tokens_bucket = self.buckets[provider]
+        if self.waiting[provider][0] is entry:
+            wait_s = max(requests_bucket.wait_time(1), tokens_bucket.wait_time(entry[3]))
+            if wait_s == 0:
+                heapq.heappop(self.waiting[provider])
+                requests_bucket.take(1)
+                tokens_bucket.take(entry[3])
+                self.served[session] += 1
+                self.cond.notify_all()
+                return True, 0.0
+        return False, self.estimate_wait(provider, entry)
+
+    def acquire(self, provider, session, priority="turn", tokens=0, on_wait=None, timeout=ADMISSION_TIMEOUT):
+        """차례가 와서 한도 안에 들어갈 때까지 기다림 (on_wait(예상 초)로 대기 상황을 알림)"""
+        if provider not in self.buckets:
+            return
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            entry = [self.PRIORITY[priority], self.served[session], next(self.sequence), tokens]
+            heapq.heappush(self.waiting[provider], entry)
+        admitted = False
+        try:
+            while True:
+                with self.cond:
+                    admitted, wait_s = self.try_admit(provider, entry, session)
+                if admitted:
+                    return
+                if time.monotonic() + wait_s > deadline:
+                    raise AdmissionTimeout(f"{provider} 대기열이 너무 길어요 (예상 {wait_s:.0f}초)")
+                if on_wait:
+                    on_wait(wait_s)
+                with self.cond:
+                    self.cond.wait(timeout=min(max(wait_s, 0.05), 1.0))
+        finally:
+            if not admitted:
+                with self.cond:
+                    self.waiting[provider].remove(entry)
+                    heapq.heapify(self.waiting[provider])
+                    self.cond.notify_all()
+
+def create_admission_scheduler(secrets):
+    """DEFAULT_LIMITS에 secrets의 [limits] 설정을 덮어써서 입장 관리자를 만듦"""
+    configured = secrets.get("limits", {})
+    return AdmissionScheduler({
+        name: {**limits, **configured.get(name, {})} for name, limits in DEFAULT_LIMITS.items()
+    })
+
+def estimate_request_tokens(conversation_history, system_prompt, include_cached=True):
+    """요청 하나의 입력 토큰 추정 (include_cached=False면 캐시에서 읽히는 블록은 셈에서 뺌)"""
+    blocks = [{"text": system_prompt}] if isinstance(system_prompt, str) else system_prompt
+    system_tokens = sum(estimate_tokens(b["text"]) for b in blocks if include_cached or "cache_control" not in b)
+    return system_tokens + sum(estimate_tokens(m["content"]) + 4 for m in conversation_history)
+
+def admission_request(scheduler, conversation_history, system_prompt, priority, session, on_wait=None):
+    """call_with_fallback / stream_with_fallback에 넘길 입장 요청 정보"""
+    return {
+        "scheduler": scheduler,
+        "session": session,
+        "priority": priority,
+        "tokens": {
+            # Claude는 캐시에서 읽은 토큰이 입력 토큰 한도에 잡히지 않음
+            "claude": estimate_request_tokens(conversation_history, system_prompt, include_cached=False),
+            "gpt": estimate_request_tokens(conversation_history, system_prompt),
+        },
+        "on_wait": on_wait,
+    }
+
+def admit(provider, admission):
+    if admission:
+        admission["scheduler"].acquire(
+            provider.name, admission["session"], admission["priority"],
+            admission["tokens"].get(provider.name, 0), admission["on_wait"],
+        )
+
+def claude_headers(provider):
+    return {
+        "x-api-key": provider.api_key,
+        "anthropic-version": "2023-06-01",
+        "Content-Type": "application/json"
+    }
+
+def claude_payload(conversation_history, system_prompt, stream=False):
+    data = {
+        "model": "claude-sonnet-4-20250514",
+        "max_tokens": 512,
+        "system": system_prompt,
+        "messages": conversation_history
+    }
+    if stream:
+        data["stream"] = True
+    return data
+
+def check_claude_status(res):
+    if res.status_code != 200:
+        raise ProviderError(f"❌ Claude API 오류: {res.status_code} - {res.text}",
+                            retryable=res.status_code in RETRYABLE_STATUS)
+
+def claude_complete(provider, conversation_history, system_prompt, usage):
+    res = provider.session.post((provider.base_url or CLAUDE_BASE_URL) + "/v1/messages",
+                                headers=claude_headers(provider), json=claude_payload(conversation_history, system_prompt),
+                                timeout=(LLM_CONNECT_TIMEOUT, provider.deadline))
+    check_claude_status(res)
+    result = res.json()
+    usage.update(result.get("usage", {}))
+    text = "".join(block.get("text", "") for block in result.get("content", []))
+    if not text.strip():
+        raise ProviderError("Claude 응답이 비어 있어")  # 빈 답을 대화에 넣으면 다음 요청이 400으로 거절됨
+    return text
+
+def claude_stream(provider, conversation_history, system_prompt, usage):
+    """Claude SSE 응답을 텍스트 조각으로 내보냄 (usage에 토큰 사용량을 채움)"""
+    deadline = time.time() + provider.deadline
+    data = claude_payload(conversation_history, system_prompt, stream=True)
+    with provider.session.post((provider.base_url or CLAUDE_BASE_URL) + "/v1/messages",
+                               headers=claude_headers(provider), json=data, stream=True,
+                               timeout=(LLM_CONNECT_TIMEOUT, provider.deadline)) as res:
+        check_claude_status(res)
+        res.encoding = "utf-8"  # text/event-stream에는 charset이 없어서 직접 지정
+        for line in res.iter_lines(decode_unicode=True):
+            if time.time() > deadline:
+                raise ProviderError("Claude 응답 마감 시간 초과")
+            if not line or not line.startswith("data:"):
+                continue
+            event = json.loads(line[len("data:"):])
+            if event["type"] == "message_start":
+                usage.update(event["message"].get("usage", {}))
+            elif event["type"] == "message_delta":
+                usage.update(event.get("usage", {}))
+            elif event["type"] == "content_block_delta" and event["delta"].get("type") == "text_delta":
+                yield event["delta"]["text"]
+            elif event["type"] == "error":
+                raise ProviderError(event["error"].get("message", "Claude 스트림 오류"))
+
+def gpt_messages_for(conversation_history, system_prompt):
+    return [{"role": "system", "content": system_prompt_to_text(system_prompt)}] + conversation_history
+
+def record_gpt_usage(usage, reported):
+    """OpenAI 사용량을 Claude와 같은 키로 옮겨 적음 (prompt_tokens에는 캐시에서 읽은 토큰도 들어 있음)"""
+    if usage is None or reported is None:
+        return
+    details = getattr(reported, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) or 0
+    usage.update({
+        "input_tokens": reported.prompt_tokens - cached,
+        "cache_read_input_tokens": cached,
+        "output_tokens": reported.completion_tokens,
+    })
+
+def gpt_complete(provider, conversation_history, system_prompt, usage=None):
+    gpt_res = provider.openai_client().chat.completions.create(
+        model="gpt-4o",
+        messages=gpt_messages_for(conversation_history, system_prompt),
+        max_tokens=512,
+        temperature=0.8,
+        timeout=provider.deadline,
+    )
+    record_gpt_usage(usage, gpt_res.usage)
+    text = gpt_res.choices[0].message.content if gpt_res.choices else None
+    if not (text or "").strip():
+        raise ProviderError("GPT 응답이 비어 있어")
+    return text
+
+def gpt_stream(provider, conversation_history, system_prompt, usage=None):
+    """GPT-4o 스트림을 텍스트 조각으로 내보냄 (usage를 넘기면 마지막 조각의 토큰 사용량을 채움)"""
+    deadline = time.time() + provider.deadline
+    gpt_res = provider.openai_client().chat.completions.create(
+        model="gpt-4o",
+        messages=gpt_messages_for(conversation_history, system_prompt),
+        max_tokens=512,
+        temperature=0.8,
+        timeout=provider.deadline,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    for chunk in gpt_res:
+        if time.time() > deadline:
+            raise ProviderError("GPT 응답 마감 시간 초과")
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+        record_gpt_usage(usage, getattr(chunk, "usage", None))
+
+def timed_call(provider, fn):
+    """호출 결과를 프로바이더 통계와 서킷 브레이커에 반영"""
+    start = time.time()
+    try:
+        result = fn()
+    except Exception:
+        provider.record_failure()
+        raise
+    provider.record_success(time.time() - start)
+    return result
+
+def all_failed(error):
+    """모든 프로바이더가 실패했을 때 던질 오류 (화면에서 한 번에 잡을 수 있게 ProviderError로 맞춤)"""
+    if isinstance(error, ProviderError):
+        return error
+    return ProviderError(f"모든 모델 호출이 실패했어: {error}" if error else "모든 모델의 응답 시간이 초과됐어")
+
+def call_with_fallback(primary, fallback, executor, admission=None):
+    """primary를 먼저 부르고, 실패하거나 (헤지 시) p95 안에 답이 없으면 fallback도 불러 먼저 성공한 결과 반환
+
+    primary, fallback은 (ProviderClient, 인자 없는 호출 함수) 쌍, executor는 호출을 돌릴 스레드 풀.
+    반환값은 (결과, 프로바이더 이름)
+    admission이 있으면 각 프로바이더를 부르기 전에 공유 대기열에서 차례를 기다림
+    """
+    pending = {}
+    error = None
+
+    def start(provider, fn):
+        admit(provider, admission)
+        pending[executor.submit(timed_call, provider, fn)] = provider
+
+    primary_provider, primary_fn = primary
+    fallback_provider, fallback_fn = fallback
+    if primary_provider.breaker.allow():
+        try:
+            start(primary_provider, primary_fn)
+        except AdmissionTimeout as e:
+            primary_provider.count("admission_timeout")
+            error = e
+        hedge_after = primary_provider.hedge_after("complete")
+        done, _ = wait(pending, timeout=hedge_after or primary_provider.deadline)
+        for future in done:
+            pending.pop(future)
+            try:
+                return future.result(), primary_provider.name
+            except ProviderError as e:
+                if not e.retryable:
+                    raise
+                error = e
+            except Exception as e:
+                error = e
+        if pending:
+            primary_provider.count("hedged" if hedge_after else "timeout")
+    else:
+        primary_provider.count("circuit_open")
+
+    fallback_provider.count("fallback")
+    try:
+        start(fallback_provider, fallback_fn)
+    except AdmissionTimeout as e:
+        # 헤지 중이면 아직 돌고 있는 primary를 계속 기다림
+        fallback_provider.count("admission_timeout")
+        error = e
+    deadline = time.time() + fallback_provider.deadline
+    while pending:
+        done, _ = wait(pending, timeout=max(0, deadline - time.time()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            provider = pending.pop(future)
+            try:
+                return future.result(), provider.name
+            except Exception as e:
+                error = e
+    raise all_failed(error)
+
+def pump_stream(provider, make_stream, out, stop):
+    """작업 스레드에서 스트림을 읽어 큐로 넘김 (stop이 켜지면 중단)
+
+    글자가 나오기 전의 빈·공백 조각은 모아 두었다가 첫 글자와 함께 넘기고,
+    글자 없이 끝난 스트림은 실패로 넘겨서 다른 모델이 대신 답하게 함.
+    """
+    start = time.time()
+    chunks = make_stream()
+    first = True
+    leading = ""
+    try:
+        for chunk in chunks:
+            if first:
+                provider.record_ttft(time.time() - start)
+                first = False
+            if stop.is_set():
+                return
+            if leading is not None and not chunk.strip():
+                leading += chunk
+                continue
+            out.put((provider.name, (leading or "") + chunk, None))
+            leading = None
+        if leading is not None:
+            raise ProviderError(f"{provider.name} 응답이 비어 있어")
+        provider.record_success(time.time() - start)
+        out.put((provider.name, None, None))
+    except Exception as e:
+        provider.record_failure()
+        out.put((provider.name, None, e))
+    finally:
+        chunks.close()
+
+def stream_with_fallback(primary, fallback, executor, admission=None):
+    """call_with_fallback의 스트리밍 버전. (프로바이더 이름, 텍스트 조각)을 내보냄
+
+    먼저 첫 조각을 보낸 프로바이더가 이기고, 나머지는 중단시킴.
+    이긴 프로바이더가 답 도중에 실패하거나 마감 시간을 넘기면 StreamInterrupted를 던짐.
+    """
+    out = queue.Queue()
+    stops = {}
+    finished = set()
+    winner = None
+    error = None
+
+    def start(provider, make_stream):
+        admit(provider, admission)
+        stops[provider.name] = threading.Event()
+        executor.submit(pump_stream, provider, make_stream, out, stops[provider.name])
+
+    def start_fallback():
+        """fallback을 시작하고, 대기열 때문에 못 들어가면 그 AdmissionTimeout을 반환"""
+        nonlocal deadline
+        fallback_provider.count("fallback")
+        try:
+            start(fallback_provider, fallback_stream)
+        except AdmissionTimeout as e:
+            fallback_provider.count("admission_timeout")
+            return e
+        # 대기열에서 기다린 시간 때문에 fallback이 답할 시간이 모자라지 않게 마감을 늦춤
+        deadline = max(deadline, time.time() + fallback_provider.deadline)
+        return None
+
+    primary_provider, primary_stream = primary
+    fallback_provider, fallback_stream = fallback
+    hedge_after = None
+    deadline = time.time() + primary_provider.deadline + fallback_provider.deadline
+    if primary_provider.breaker.allow():
+        try:
+            start(primary_provider, primary_stream)
+            hedge_after = primary_provider.hedge_after("first_token")
+        except AdmissionTimeout:
+            primary_provider.count("admission_timeout")
+            error = start_fallback()
+    else:
+        primary_provider.count("circuit_open")
+        error = start_fallback()
+    if not stops:
+        raise error  # 어느 모델도 대기열을 통과하지 못함
+    hedge_at = time.time() + hedge_after if hedge_after else None
+
+    try:
+        while True:
+            fallback_started = fallback_provider.name in stops
+            if winner is None and not fallback_started and hedge_at:
+                timeout = max(0, hedge_at - time.time())
+            else:
+                timeout = max(0, deadline - time.time())
+            try:
+                name, chunk, err = out.get(timeout=timeout)
+            except queue.Empty:
+                if winner is None and not fallback_started and hedge_at:
+                    primary_provider.count("hedged")
+                    hedge_at = None
+                    start_fallback()  # 대기열에 막히면 primary만 계속 기다림
+                    continue
+                if winner is not None:
+                    raise StreamInterrupted(f"{winner} 응답이 마감 시간 안에 끝나지 않았어")
+                raise all_failed(error)
+
+            if winner is not None and name != winner:
+                continue
+            if err is not None:
+                # 이미 일부를 보여줬다면 다른 모델 답변을 이어붙이지 않고 끊겼다고 알림
+                if winner is not None:
+                    raise StreamInterrupted(f"{winner} 응답이 중간에 끊겼어: {err}")
+                if isinstance(err, ProviderError) and not err.retryable and name == primary_provider.name:
+                    raise err
+                error = err
+                finished.add(name)
+                if not fallback_started:
+                    error = start_fallback() or error
+                if finished >= stops.keys():
+                    raise all_failed(error)
+                continue
+            if chunk is None:
+                if winner is not None or finished | {name} >= stops.keys():
+                    return
+                finished.add(name)
+                continue
+            if winner is None:
+                winner = name
+                for other, stop in stops.items():
+                    if other != winner:
+                        stop.set()
+            yield name, chunk
+    finally:
+        for stop in stops.values():
+            stop.set()
+
+RESPONSE_CACHE_TTL = 24 * 3600      # 초
+RESPONSE_CACHE_MEMORY_ITEMS = 256   # 메모리 LRU 항목 수
+RESPONSE_CACHE_DISK_ITEMS = 5000    # SQLite 항목 수
+RESPONSE_CACHE_WAIT = 60            # 같은 요청이 진행 중일 때 기다리는 최대 시간(초)
+
+class ResponseCache:
+    """입력 해시로 찾는 응답 캐시: 메모리 LRU + (선택) SQLite, TTL·개수 제한, 진행 중 요청 공유
+
+    같은 키로 동시에 들어온 요청은 하나만 실제로 호출하고(leader) 나머지는 그 결과를 기다림.
+    """
+
+    def __init__(self, sqlite_path=None, ttl=RESPONSE_CACHE_TTL, memory_items=RESPONSE_CACHE_MEMORY_ITEMS,
+                 disk_items=RESPONSE_CACHE_DISK_ITEMS):
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self.memory = OrderedDict()   # key -> (저장 시각, 응답)
+        self.inflight = {}            # key -> Future
+        self.lock = threading.Lock()
+        self.stats = defaultdict(Counter)   # 단계 -> {memory_hit, disk_hit, shared, miss}
+        self.db = None
+        if sqlite_path:
+            Path(sqlite_path).parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(sqlite_path), check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS responses "
+                            "(key TEXT PRIMARY KEY, created REAL, accessed REAL, response TEXT)")
+            self.db.commit()
+
+    def remember(self, key, created, response):
+        self.memory[key] = (created, response)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def lookup(self, key):
+        """(응답, "memory"/"disk") 또는 (None, None). lock을 잡은 채로 부름"""
+        now = time.time()
+        entry = self.memory.get(key)
+        if entry:
+            if now - entry[0] < self.ttl:
+                self.memory.move_to_end(key)
+                return entry[1], "memory"
+            del self.memory[key]
+        if self.db is None:
+            return None, None
+        row = self.db.execute("SELECT created, response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, None
+        if now - row[0] >= self.ttl:
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.db.commit()
+            return None, None
+        self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        self.db.commit()
+        self.remember(key, row[0], row[1])
+        return row[1], "disk"
+
+    def begin(self, stage, key):
+        """("hit", 응답) / ("wait", Future) / ("leader", None) 중 하나를 반환
+
+        leader가 되면 반드시 finish() 또는 abandon()을 불러야 함
+        """
+        with self.lock:
+            response, tier = self.lookup(key)
+            if response is not None:
+                self.stats[stage][f"{tier}_hit"] += 1
+                return "hit", response
+            if key in self.inflight:
+                self.stats[stage]["shared"] += 1
+                return "wait", self.inflight[key]
+            self.stats[stage]["miss"] += 1
+            self.inflight[key] = Future()
+            return "leader", None
+
+    def finish(self, key, response):
+        now = time.time()
+        with self.lock:
+            self.remember(key, now, response)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, now, now, response))
+                self.db.execute("DELETE FROM responses WHERE created < ? OR key NOT IN "
+                                "(SELECT key FROM responses ORDER BY accessed DESC LIMIT ?)",
+                                (now - self.ttl, self.disk_items))
+                self.db.commit()
+            future = self.inflight.pop(key, None)
+        if future:
+            future.set_result(response)
+
+    def abandon(self, key):
+        """leader가 실패했을 때: 기다리던 요청들은 각자 직접 호출하게 함"""
+        with self.lock:
+            future = self.inflight.pop(key, None)
+        if future:
+            future.set_result(None)
+
+    def hit_ratios(self):
+        """운영자용 단계별 적중률"""
+        with self.lock:
+            ratios = {}
+            for stage, counts in self.stats.items():
+                total = sum(counts.values())
+                hits = counts["memory_hit"] + counts["disk_hit"] + counts["shared"]
+                ratios[stage] = {**counts, "total": total, "hit_ratio": round(hits / total, 3) if total else None}
+            return ratios
+
+def response_cache_key(conversation_history, system_prompt):
+    """모델·시스템 프롬프트·메시지·파라미터를 합친 요청 본문의 해시"""
+    data = claude_payload([{"role": m["role"], "content": m["content"].rstrip()} for m in conversation_history],
+                          system_prompt)
+    data["fallback"] = {"model": "gpt-4o", "max_tokens": 512, "temperature": 0.8}
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+# 대화 기록 압축 설정
+HISTORY_KEEP_MESSAGES = 8       # 그대로 보낼 최근 메시지 수 (약 4턴)
+HISTORY_TOKEN_BUDGET = 2500     # 대화 기록(요약 포함)에 쓸 입력 토큰 상한
+
+def fold_boundary(messages, keep=HISTORY_KEEP_MESSAGES):
+    """요약으로 접을 메시지 개수 (남기는 최근 메시지가 학생 말로 시작하도록 맞춤)"""
+    boundary = max(0, len(messages) - keep)
+    while boundary > 0 and boundary < len(messages) and messages[boundary]["role"] != "user":
+        boundary += 1
+    return boundary if boundary < len(messages) else max(0, len(messages) - keep)
+
+def summarize_history(providers, scheduler, previous_summary, messages):
+    """(작업 스레드) 이전 요약에 오래된 메시지를 합쳐 새 요약 생성 — st.session_state를 건드리지 않음"""
+    transcript = "\n".join(f"{'리토' if m['role'] == 'assistant' else '학생'}: {m['content']}" for m in messages)
+    system_prompt = "너는 문학 토론 대화 기록을 요약하는 도우미야. 요약만 써."
+    request = [{"role": "user", "content": f"""이전 요약:
+{previous_summary or "(없음)"}
+
+새로 합칠 대화:
+{transcript}
+
+학생의 해석, 질문, 감정과 리토가 제시한 다른 관점을 중심으로 5문장 이내의 갱신된 요약을 써줘."""}]
+    summary, _ = call_with_fallback(
+        (providers["claude"], lambda: claude_complete(providers["claude"], request, system_prompt, {})),
+        (providers["gpt"], lambda: gpt_complete(providers["gpt"], request, system_prompt)),
+        providers["executor"],
+        admission=admission_request(scheduler, request, system_prompt, "background", "background"),
+    )
+    return summary.strip()
+
+def compact_messages(messages, summary, start, budget=HISTORY_TOKEN_BUDGET):
+    """(요약, 그대로 보낼 최근 메시지)를 토큰 예산 안에서 반환
+
+    start는 요약에 이미 접힌 메시지 수. 요약이 아직 따라오지 못한 메시지는 그대로 보내되,
+    예산을 넘으면 오래된 것부터 뺌
+    """
+
+    def cost(begin):
+        return estimate_tokens(summary) + sum(estimate_tokens(m["content"]) + 4 for m in messages[begin:])
+
+    # 예산을 넘으면 오래된 것부터 빼되, 다음 학생 말에서 시작하도록 맞춤
+    while start < len(messages) - 1 and cost(start) > budget:
+        start += 1
+        while start < len(messages) - 1 and messages[start]["role"] != "user":
+            start += 1
+    overflow = cost(start) - budget
+    if overflow > 0 and summary:
+        summary = summary[:max(0, len(summary) - overflow)]
+    return summary, messages[start:]
+
+OUTBOX_DIR = Path(__file__).parent / "outbox"
+
+class EmailOutbox:
+    """디스크 발송함(outbox)과 백그라운드 발송 스레드
+
+    메일은 pending/ 폴더에 먼저 저장되고, 작업 스레드가 인증된 SMTP 연결 하나를
+    재사용해서 묶음으로 보냄. 보낸 메일은 sent/에 같은 이름의 빈 표시 파일만 남기고(중복 발송 방지용,
+    첨부는 보관하지 않음), 영구 실패하거나 깨진 메일은 failed/로 옮김.
+    서버가 재시작돼도 pending/에 남은 메일은 다시 발송됨.
+    """
+
+    def __init__(self, spool_dir, host, port, user, password, use_ssl=True, batch_size=20, max_backoff=300,
+                 telemetry=None):
+        self.telemetry = telemetry
+        self.pending_dir = spool_dir / "pending"
+        self.sent_dir = spool_dir / "sent"
+        self.failed_dir = spool_dir / "failed"
+        for folder in [self.pending_dir, self.sent_dir, self.failed_dir]:
+            folder.mkdir(parents=True, exist_ok=True)
+        self.host, self.port, self.use_ssl = host, port, use_ssl
+        self.user, self.password = user, password
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.smtp = None
+        self.wakeup = threading.Event()
+        self.wakeup.set()  # 재시작 전에 남은 메일부터 바로 보냄
+        threading.Thread(target=self.run, name="email-outbox", daemon=True).start()
+
+    def enqueue(self, msg, dedup_key):
+        """메일을 발송함에 저장하고 바로 반환 (같은 키의 메일이 이미 있으면 무시)"""
+        filename = f"{dedup_key}.eml"
+        if any((folder / filename).exists() for folder in [self.pending_dir, self.sent_dir]):
+            return False
+        tmp_path = self.pending_dir / f"{dedup_key}.tmp"
+        tmp_path.write_bytes(msg.as_bytes())
+        os.replace(tmp_path, self.pending_dir / filename)  # 쓰다 만 파일이 발송되지 않도록 원자적 이동
+        self.wakeup.set()
+        return True
+
+    def pending(self):
+        return sorted(self.pending_dir.glob("*.eml"), key=lambda path: path.stat().st_mtime)
+
+    def connection(self):
+        """살아 있는 연결은 재사용하고, 끊겼으면 새로 연결해서 로그인"""
+        import smtplib
+
+        if self.smtp is not None:
+            try:
+                if self.smtp.noop()[0] == 250:
+                    return self.smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.close()
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        self.smtp = smtp_class(self.host, self.port, timeout=30)
+        if self.user and self.password:
+            self.smtp.login(self.user, self.password)
+        return self.smtp
+
+    def close(self):
+        import smtplib
+
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.smtp = None
+
+    def send_batch(self, paths):
+        import smtplib
+        from email import message_from_bytes, policy
+
+        start = time.perf_counter()
+        smtp = self.connection()
+        for path in paths:
+            if (self.sent_dir / path.name).exists():
+                path.unlink(missing_ok=True)  # 보낸 뒤 pending/을 지우기 전에 멈췄던 메일
+                continue
+            try:
+                smtp.send_message(message_from_bytes(path.read_bytes(), policy=policy.default))
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                # 5xx 응답은 재시도해도 소용없으므로 failed/로 보관
+                code = getattr(e, "smtp_code", 550)
+                if code < 500:
+                    raise
+                self.move_to_failed(path, e)
+                continue
+            except (smtplib.SMTPException, OSError):
+                raise  # 연결 문제는 묶음 전체를 나중에 다시 시도
+            except Exception as e:
+                # 깨진 .eml처럼 다시 보내도 소용없는 메일만 빼고 나머지는 계속 보냄
+                self.move_to_failed(path, e)
+                continue
+            (self.sent_dir / path.name).touch()
+            path.unlink(missing_ok=True)
+        if self.telemetry:
+            self.telemetry.emit("smtp_batch", ms=elapsed_ms(start), messages=len(paths))
+
+    def move_to_failed(self, path, error):
+        os.replace(path, self.failed_dir / path.name)
+        if self.telemetry:
+            self.telemetry.emit("smtp_failed", file=path.name, error=str(error)[:200])
+
+    def run(self):
+        backoff = 1
+        while True:
+            self.wakeup.wait(timeout=30)
+            self.wakeup.clear()
+            pending = self.pending()
+            while pending:
+                try:
+                    self.send_batch(pending[:self.batch_size])
+                    backoff = 1
+                except Exception as e:  # 어떤 오류가 나도 발송 스레드는 살아 있어야 함
+                    self.close()
+                    if self.telemetry:
+                        self.telemetry.emit("smtp_batch", error=str(e)[:200], retry_in=backoff)
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                pending = self.pending()
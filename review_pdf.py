@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""감상문 PDF 텍스트 추출 (PyMuPDF, 쪽 수·시간 제한)"""
+import time
+
+
+class PdfExtractionError(Exception):
+    """PDF를 읽을 수 없거나 제한을 넘었을 때"""
+
+
+def extract_pdf_text(content, max_pages=30, timeout=None):
+    """PDF 바이트에서 쪽 단위로 텍스트를 읽음
+
+    max_pages쪽까지만 읽고, timeout초가 지나면 그때까지 읽은 쪽만 반환함.
+    반환값: {"text", "pages", "total_pages", "truncated", "chars", "bytes", "elapsed"}
+    """
+    import fitz  # PyMuPDF는 무거워서 PDF를 처음 읽을 때 import함
+
+    start = time.perf_counter()
+    deadline = start + timeout if timeout else None
+    parts = []
+    try:
+        # bytes를 그대로 넘겨서 추가 복사 없이 메모리에서 바로 엶
+        with fitz.open(stream=content, filetype="pdf") as doc:
+            if doc.needs_pass:
+                raise PdfExtractionError("암호가 걸린 PDF는 읽을 수 없어요.")
+            total_pages = doc.page_count
+            for page_number in range(min(total_pages, max_pages)):
+                if deadline and time.perf_counter() > deadline:
+                    break
+                parts.append(doc.load_page(page_number).get_text("text"))
+    except (RuntimeError, ValueError) as e:  # fitz.FileDataError 등
+        raise PdfExtractionError(f"PDF를 읽을 수 없어요: {e}") from e
+
+    text = "\n".join(parts).strip()
+    return {
+        "text": text,
+        "pages": len(parts),
+        "total_pages": total_pages,
+        "truncated": len(parts) < total_pages,
+        "chars": len(text),
+        "bytes": len(content),
+        "elapsed": time.perf_counter() - start,
+    }
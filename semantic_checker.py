@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""2단계 의미 검사기: 키워드 검사가 놓치는 돌려 말한 욕설·딴 얘기와, 소설 인용을 욕설로 잘못 잡는 경우를 판단
+
+CPU만 쓰는 작은 모델 두 개를 씀
+  - 소설 장면과의 글자 bigram 유사도(idf 가중 코사인), 글자 trigram 인용 비율
+  - moderation_train.jsonl로 학습하는 글자 n-gram 나이브 베이즈 (ok / off_topic / inappropriate)
+메시지 하나에 1ms 안팎이라서 본 LLM 호출과 동시에 돌리면 대화 턴 지연이 늘지 않음.
+"""
+import json
+import math
+import re
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from litbot_core import char_ngrams
+
+MODERATION_TRAIN_PATH = Path(__file__).parent / "moderation_train.jsonl"
+LABELS = ["ok", "off_topic", "inappropriate"]
+
+QUOTE_MIN_RATIO = 0.6        # 이 비율 이상의 글자 trigram이 소설에 있으면 인용으로 봄
+ON_TOPIC_SIMILARITY = 0.25   # 소설 장면과 이만큼 비슷하면 주제 이탈로 보지 않음 (일상 대화는 대개 0.2 아래)
+INAPPROPRIATE_CONTEXT = 0.5  # 문맥 의존 표현("죽어" + "버려" 등)이 있을 때 부적절 판정 확률
+INAPPROPRIATE_ALONE = 0.8    # 키워드 없이 모델만으로 부적절 판정하는 확률
+OFF_TOPIC_MIN = 0.6          # 모델만으로 주제 이탈 판정하는 확률
+MODERATION_TIMEOUT = 0.5     # 답변이 끝났는데 검사가 아직이면 이만큼만 더 기다리고 답변을 그대로 씀
+MODERATION_PRECHECK = 0.005  # LLM을 부르기 직전에 검사 결과를 기다리는 시간 (이때 걸리면 LLM을 부르지 않음)
+
+
+class ModerationFlag(Exception):
+    """2단계 검사가 메시지를 걸러서 LLM 답변을 끊었음 (verdict에 판정 결과)"""
+
+    def __init__(self, verdict):
+        super().__init__(verdict["label"])
+        self.verdict = verdict
+
+
+def normalize(text):
+    return re.sub(r"\s+", " ", text.strip().lower())
+
+
+class CharNgramNaiveBayes:
+    """글자 1~3-gram 다항 나이브 베이즈 (클래스 사전확률은 균등하게 둠)"""
+
+    def __init__(self, n_max=3, alpha=0.5):
+        self.n_max = n_max
+        self.alpha = alpha
+        self.counts = defaultdict(Counter)
+        self.totals = Counter()
+        self.vocabulary = set()
+
+    def features(self, text):
+        text = normalize(text)
+        return [text[i:i + n] for n in range(1, self.n_max + 1) for i in range(len(text) - n + 1)]
+
+    def fit(self, examples):
+        for text, label in examples:
+            grams = self.features(text)
+            self.counts[label].update(grams)
+            self.totals[label] += len(grams)
+            self.vocabulary.update(grams)
+        return self
+
+    def predict_proba(self, text):
+        grams = [g for g in self.features(text) if g in self.vocabulary]  # 처음 보는 n-gram은 판단에 쓰지 않음
+        vocabulary_size = len(self.vocabulary)
+        log_probs = {}
+        for label in self.counts:
+            denominator = self.totals[label] + self.alpha * vocabulary_size
+            log_probs[label] = sum(math.log((self.counts[label][g] + self.alpha) / denominator) for g in grams)
+        top = max(log_probs.values())
+        exp = {label: math.exp(lp - top) for label, lp in log_probs.items()}
+        total = sum(exp.values())
+        return {label: value / total for label, value in exp.items()}
+
+
+class SemanticChecker:
+    """키워드 적중(hits)과 로컬 모델 점수를 합쳐 ok / off_topic / inappropriate를 판정"""
+
+    def __init__(self, classifier, passage_index, novel_text, examples):
+        self.classifier = classifier
+        self.index = passage_index
+        self.passage_norms = [
+            math.sqrt(sum((tf[t] * passage_index["idf"][t]) ** 2 for t in tf)) or 1.0
+            for tf in passage_index["term_freqs"]
+        ]
+        self.novel_trigrams = set(char_ngrams(novel_text, 3))
+        self.model = CharNgramNaiveBayes().fit(examples)
+
+    def novel_similarity(self, text):
+        """소설 장면 중 가장 비슷한 장면과의 idf 가중 글자 bigram 코사인 유사도"""
+        idf = self.index["idf"]
+        query = Counter(t for t in char_ngrams(text) if t in idf)
+        if not query:
+            return 0.0
+        query_norm = math.sqrt(sum((count * idf[t]) ** 2 for t, count in query.items()))
+        best = 0.0
+        for tf, norm in zip(self.index["term_freqs"], self.passage_norms):
+            dot = sum(count * tf[t] * idf[t] ** 2 for t, count in query.items() if t in tf)
+            best = max(best, dot / (query_norm * norm))
+        return best
+
+    def quote_ratio(self, text):
+        """글자 trigram 중 소설 본문에도 나오는 비율 (높으면 소설 구절을 옮긴 것)"""
+        grams = char_ngrams(text, 3)
+        return sum(g in self.novel_trigrams for g in grams) / len(grams) if grams else 0.0
+
+    def context_expression(self, text, hits):
+        """문맥 의존 표현 중 소설 인용 안에 들어 있지 않은 것 (없으면 None)"""
+        expression = self.classifier.find_inappropriate(hits)
+        if expression is None:
+            return None
+        for start, keyword, _ in hits["context_main"]:
+            window = text[max(0, start - 6):start + len(keyword) + 6]
+            if self.quote_ratio(window) < QUOTE_MIN_RATIO:
+                return expression
+        return None
+
+    def check(self, text, hits):
+        """판정 결과 딕셔너리: label, flagged, expression(부적절한 표현), 점수들, ms"""
+        start = time.perf_counter()
+        probs = self.model.predict_proba(text)
+        similarity = self.novel_similarity(text)
+        quote = self.quote_ratio(text)
+        label, expression = "ok", None
+
+        if hits["profanity"]:
+            label, expression = "inappropriate", self.classifier.find_profanity(hits)
+        elif len(text) > 3:
+            expression = self.context_expression(text, hits)
+            if quote >= QUOTE_MIN_RATIO:
+                expression = None  # 소설 구절을 그대로 옮긴 말은 욕설로 보지 않음
+            elif expression and probs["inappropriate"] >= INAPPROPRIATE_CONTEXT:
+                label = "inappropriate"
+            elif probs["inappropriate"] >= INAPPROPRIATE_ALONE:
+                label, expression = "inappropriate", expression or text[:20]
+            if label == "ok":
+                expression = None
+                on_topic = bool(hits["novel_terms"]) or similarity >= ON_TOPIC_SIMILARITY
+                if not on_topic and (probs["off_topic"] >= OFF_TOPIC_MIN
+                                     or (hits["off_topic_terms"] and probs["off_topic"] >= probs["ok"])):
+                    label = "off_topic"
+
+        return {
+            "label": label,
+            "flagged": label != "ok",
+            "expression": expression,
+            "probs": {k: round(v, 3) for k, v in probs.items()},
+            "novel_similarity": round(similarity, 3),
+            "quote_ratio": round(quote, 3),
+            "ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+
+
+def moderated_stream(chunks, verdict_future, timeout=MODERATION_TIMEOUT):
+    """LLM 스트림을 그대로 흘려보내다가 검사 결과가 문제를 표시하면 스트림을 닫고 ModerationFlag를 던짐
+
+    검사는 보통 첫 토큰보다 먼저 끝나서 걸러지는 메시지는 답변이 한 글자도 나오기 전에 멈춤.
+    스트림을 닫으면 위쪽 LLM 호출도 함께 멈춤. 검사가 늦거나 실패하면 답변을 그대로 둠.
+    """
+    try:
+        for chunk in chunks:
+            verdict = finished_verdict(verdict_future) if verdict_future.done() else None
+            if verdict and verdict["flagged"]:
+                raise ModerationFlag(verdict)
+            yield chunk
+        verdict = finished_verdict(verdict_future, timeout)
+    finally:
+        chunks.close()
+    if verdict and verdict["flagged"]:
+        raise ModerationFlag(verdict)
+
+
+def finished_verdict(verdict_future, timeout=0):
+    """검사 결과, 시간 안에 안 끝났거나 검사 자체가 실패했으면 None (통과로 봄)"""
+    try:
+        return verdict_future.result(timeout=timeout)
+    except Exception:
+        return None
+
+
+def load_examples(path=MODERATION_TRAIN_PATH):
+    with open(path, encoding="utf-8") as f:
+        return [(row["text"], row["label"]) for row in map(json.loads, f) if row.get("text")]
+
+
+def load_semantic_checker(classifier, passage_index, novel_text, path=MODERATION_TRAIN_PATH):
+    return SemanticChecker(classifier, passage_index, novel_text, load_examples(path))
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""학생별 대화 세션 저장소 (SQLite WAL, 백그라운드 묶음 쓰기)
+
+연결이 끊기거나 새로고침해도 같은 학생이 이름과 학생 코드를 다시 입력하면 대화·타이머·제출 상태가 그대로 복원됨.
+운영자는 모든 학생의 대화 기록을 한 번에 내보낼 수 있음:
+
+    python session_store.py export transcripts.zip
+"""
+import argparse
+import hashlib
+import io
+import json
+import queue
+import sqlite3
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+from litbot_core import start_batch_writer
+
+SESSION_DB_PATH = Path(__file__).parent / "sessions" / "sessions.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    student_id TEXT PRIMARY KEY,
+    name TEXT,
+    state TEXT,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    student_id TEXT,
+    seq INTEGER,
+    role TEXT,
+    content TEXT,
+    ts REAL,
+    PRIMARY KEY (student_id, seq)
+);
+CREATE TABLE IF NOT EXISTS prepared (
+    key TEXT PRIMARY KEY,
+    name TEXT,
+    source TEXT,
+    prompt_hash TEXT,
+    opening TEXT,
+    review_topics TEXT,
+    created REAL
+);
+"""
+
+
+def prepared_key(user_name, review_content):
+    """배치 모드로 미리 만든 결과를 찾는 키 (학생 이름 + 줄바꿈·앞뒤 공백을 맞춘 감상문)"""
+    review = review_content.replace("\r\n", "\n").strip()
+    return hashlib.sha256(f"{user_name.strip()}\0{review}".encode("utf-8")).hexdigest()
+
+
+class SessionStore:
+    """append()/save_state()는 큐에 넣고 바로 반환하고, 작업 스레드가 모아서 한 트랜잭션으로 씀"""
+
+    def __init__(self, path=SESSION_DB_PATH, flush_interval=0.5, batch_size=500):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.written = threading.Condition()
+        self.enqueued_count = 0
+        self.written_count = 0
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # WAL에서는 커밋마다 fsync하지 않아도 깨지지 않음
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+        start_batch_writer("session-store", self.queue, self.write_batch, flush_interval, batch_size)
+
+    def put(self, op):
+        with self.written:
+            self.enqueued_count += 1
+            self.queue.put(op)
+
+    def append(self, student_id, seq, role, content):
+        """메시지 한 개 추가 (seq는 학생별 대화 순번)"""
+        self.put(("message", (student_id, seq, role, content, time.time())))
+
+    def save_state(self, student_id, name, state):
+        """타이머·제출 여부 등 세션 상태 저장 (JSON으로 직렬화 가능한 값만)"""
+        self.put(("state", (student_id, name, json.dumps(state, ensure_ascii=False), time.time())))
+
+    def write_batch(self, batch):
+        messages = [args for kind, args in batch if kind == "message"]
+        states = [args for kind, args in batch if kind == "state"]
+        try:
+            with self.lock:
+                self.db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)", messages)
+                self.db.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)", states)
+                self.db.commit()
+        except sqlite3.Error:
+            pass  # 저장 실패가 수업을 막으면 안 됨 (이메일 기록은 따로 남음)
+        with self.written:
+            self.written_count += len(batch)
+            self.written.notify_all()
+
+    def flush(self, timeout=5):
+        """지금까지 넣은 쓰기가 모두 반영될 때까지 기다림"""
+        with self.written:
+            target = self.enqueued_count
+            return self.written.wait_for(lambda: self.written_count >= target, timeout=timeout)
+
+    def load(self, student_id):
+        """(상태 딕셔너리, 메시지 목록) 또는 저장된 세션이 없으면 (None, [])"""
+        self.flush()
+        with self.lock:
+            row = self.db.execute("SELECT state FROM sessions WHERE student_id = ?", (student_id,)).fetchone()
+            messages = self.db.execute("SELECT role, content FROM messages WHERE student_id = ? ORDER BY seq",
+                                       (student_id,)).fetchall()
+        state = json.loads(row[0]) if row else None
+        return state, [{"role": role, "content": content} for role, content in messages]
+
+    def save_prepared(self, key, name, source, prompt_hash, opening, review_topics):
+        """배치 모드 결과를 바로 저장 (수업 전 오프라인 작업이라 묶음 쓰기 없이 즉시 커밋)"""
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO prepared VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (key, name, source, prompt_hash, opening,
+                             json.dumps(review_topics, ensure_ascii=False), time.time()))
+            self.db.commit()
+
+    def load_prepared(self, key):
+        """미리 만든 첫 질문·감상문 주제, 없으면 None"""
+        with self.lock:
+            row = self.db.execute("SELECT name, source, prompt_hash, opening, review_topics "
+                                  "FROM prepared WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        name, source, prompt_hash, opening, review_topics = row
+        return {"name": name, "source": source, "prompt_hash": prompt_hash, "opening": opening,
+                "review_topics": json.loads(review_topics)}
+
+    def export_transcripts(self, speaker="리토"):
+        """모든 학생의 대화 기록을 한 번에 읽어 ZIP(학생별 .txt + sessions.jsonl) 바이트로 반환"""
+        self.flush()
+        with self.lock:
+            sessions = self.db.execute("SELECT student_id, name, state, updated FROM sessions ORDER BY updated").fetchall()
+            rows = self.db.execute("SELECT student_id, role, content FROM messages ORDER BY student_id, seq").fetchall()
+        transcripts = {}
+        for student_id, role, content in rows:
+            transcripts.setdefault(student_id, []).append((role, content))
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            index = []
+            for student_id, name, state, updated in sessions:
+                lines = [f"{speaker if role == 'assistant' else name}의 말: {content}"
+                         for role, content in transcripts.get(student_id, [])]
+                archive.writestr(f"{name}_{student_id[:8]}_대화기록.txt", "\n".join(lines))
+                index.append(json.dumps({"student_id": student_id, "name": name, "updated": updated,
+                                         "messages": len(lines), "state": json.loads(state)}, ensure_ascii=False))
+            archive.writestr("sessions.jsonl", "\n".join(index) + "\n" if index else "")
+        return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="세션 저장소 관리")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("output", help="내보낼 ZIP 파일 경로")
+    parser.add_argument("--db", default=str(SESSION_DB_PATH), help="세션 DB 경로")
+    args = parser.parse_args()
+
+    data = SessionStore(args.db).export_transcripts()
+    Path(args.output).write_bytes(data)
+    print(f"{args.output}에 저장했어요 ({len(data):,}바이트)")
+
+
+if __name__ == "__main__":
+    main()
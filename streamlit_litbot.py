@@ -1,78 +1,148 @@
 # -*- coding: utf-8 -*-
+import time
+RERUN_STARTED = time.perf_counter()
+
 import streamlit as st
 from io import BytesIO
 from email.message import EmailMessage
-import smtplib
-import requests
-import time
-import fitz  # PyMuPDF
+from pathlib import Path
+import hashlib
+import uuid
+import json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from keyword_matcher import load_keyword_classifier
+from review_pdf import extract_pdf_text, PdfExtractionError
+from session_store import SessionStore, SESSION_DB_PATH, prepared_key
+from semantic_checker import (
+    MODERATION_PRECHECK, ModerationFlag, finished_verdict, load_semantic_checker, moderated_stream,
+)
+# 무거운 로직과 클래스는 litbot_core에 있어서 재실행마다 다시 정의되지 않음 (프로세스당 한 번 import)
+from litbot_core import (
+    ARTIFACT_DIR, BACKUP_SUMMARY, HISTORY_TOKEN_BUDGET, OPENING_INSTRUCTIONS, OPENING_REQUEST, OUTBOX_DIR,
+    RESPONSE_CACHE_DISK_ITEMS, RESPONSE_CACHE_MEMORY_ITEMS, RESPONSE_CACHE_TTL, RESPONSE_CACHE_WAIT, TELEMETRY_PATH,
+    AdmissionTimeout, EmailOutbox, PromptBuilder, ProviderError, ResponseCache, StreamInterrupted,
+    TelemetrySink,
+    admission_request, claude_stream, compact_messages, create_admission_scheduler, create_final_question,
+    create_llm_providers,
+    elapsed_ms, fold_boundary, gpt_stream, load_novel_artifacts, ordered_review_topics,
+    response_cache_key, stream_with_fallback, summarize_history,
+)
 
+IMPORTS_MS = elapsed_ms(RERUN_STARTED)  # 첫 실행에서만 실제 import 비용이 잡히고 이후 재실행에서는 0에 가까움
 
-def check_inappropriate_content(user_message):
-    """부적절한 발언 감지 (문맥 고려)"""
-    
-    # 명확히 부적절한 표현들만
-    clearly_inappropriate = [
-        "ㅂㅅ", "병신", "미친놈", "미친년",
-        "꺼져", "씨발", "존나", "개새끼"
-    ]
-    
-    # 차별적 맥락에서 사용될 때만 문제가 되는 표현들 (더 정교하게 체크)
-    context_sensitive = {
-        "여자는": ["원래", "다", "항상", "역시"],  # "여자는 원래 그래" 같은 표현
-        "남자는": ["원래", "다", "항상", "역시"],  # "남자는 다 그래" 같은 표현
-        "죽어": ["버려", "라", "야지"],           # "죽어버려" 같은 표현 (소설 인용은 괜찮)
-    }
-    
-    # 명확히 부적절한 표현 체크
-    for keyword in clearly_inappropriate:
-        if keyword in user_message:
-            return True, keyword
-    
-    # 맥락을 고려한 체크
-    for main_word, trigger_words in context_sensitive.items():
-        if main_word in user_message:
-            for trigger in trigger_words:
-                if trigger in user_message:
-                    return True, main_word + " " + trigger
-    
-    return False, None
+@st.cache_resource
+def get_telemetry():
+    """서버 프로세스당 하나의 이벤트 기록기 (모든 세션이 공유)"""
+    return TelemetrySink(st.secrets.get("telemetry", {}).get("path", TELEMETRY_PATH))
+
+def current_session_id():
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex[:12]
+    return st.session_state.session_id
+
+def emit_event(event, **fields):
+    """현재 세션 id를 붙여 성능 이벤트 기록"""
+    get_telemetry().emit(event, session=current_session_id(), **fields)
+
+def stop_script():
+    """이번 재실행 시간을 기록하고 스크립트 중단 (st.stop() 대신 사용)"""
+    persist_session()
+    emit_event("rerun", ms=elapsed_ms(RERUN_STARTED), imports_ms=IMPORTS_MS, stopped=True)
+    st.stop()
+
+# 새로고침·재접속 때 되살릴 세션 상태 (대화 메시지는 따로 한 개씩 저장)
+PERSISTED_STATE_KEYS = ["review_sent", "file_content", "start_time", "chat_disabled", "final_prompt_mode",
+                        "eight_min_warning", "reflection_sent", "history_summary", "summarized_count",
+                        "covered_topics", "review_topics"]
+
+@st.cache_resource
+def get_session_store():
+    """서버 프로세스당 하나의 세션 저장소 (모든 세션이 공유)"""
+    return SessionStore(st.secrets.get("sessions", {}).get("path", SESSION_DB_PATH))
+
+def student_key(lastname, firstname, code):
+    """세션 키: 이름만으로는 같은 이름의 다른 학생이 대화를 이어받을 수 있어서 학생이 정한 코드도 섞음"""
+    text = f"{lastname.strip()}\0{firstname.strip()}\0{code.strip()}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+def restore_session(lastname, firstname, code):
+    """이름·학생 코드에 맞는 저장된 세션이 있으면 대화·타이머·제출 상태를 되살림
+
+    감상문을 내기 전에 이름이나 코드를 고치면 새 키로 다시 찾고, 낸 뒤에는 키를 바꾸지 않음
+    """
+    key = student_key(lastname, firstname, code)
+    if st.session_state.get("student_id") == key or st.session_state.get("review_sent"):
+        return
+    start = time.perf_counter()
+    st.session_state.student_id = key
+    st.session_state.student_name = f"{lastname.strip()}{firstname.strip()}"
+    st.session_state.pop("persisted_state", None)  # 새 키로는 아직 아무것도 저장하지 않았음
+    state, messages = get_session_store().load(st.session_state.student_id)
+    if state:
+        for key, value in state.items():
+            st.session_state[key] = set(value) if key == "covered_topics" else value
+        st.session_state.messages = messages
+        st.session_state.persisted_state = json.dumps(state, ensure_ascii=False, sort_keys=True)
+        st.info("🔄 하던 대화를 이어서 할게요.")
+    emit_event("session_restore", ms=elapsed_ms(start), resumed=bool(state), messages=len(messages))
+
+def persist_session():
+    """바뀐 세션 상태만 저장소에 넘김 (실제 쓰기는 백그라운드에서 묶어서 함)"""
+    if "student_id" not in st.session_state:
+        return
+    state = {key: st.session_state[key] for key in PERSISTED_STATE_KEYS if key in st.session_state}
+    if "covered_topics" in state:
+        state["covered_topics"] = sorted(state["covered_topics"])
+    snapshot = json.dumps(state, ensure_ascii=False, sort_keys=True)
+    if snapshot != st.session_state.get("persisted_state"):
+        get_session_store().save_state(st.session_state.student_id, st.session_state.student_name, state)
+        st.session_state.persisted_state = snapshot
+
+def render_operator_summary():
+    """?ops=<키>로 열면 사이드바에 성능 요약을 보여줌 (secrets의 [telemetry] ops_key와 같아야 함)"""
+    ops_key = st.secrets.get("telemetry", {}).get("ops_key")
+    if not ops_key or st.query_params.get("ops") != ops_key:
+        return
+    rows, tokens = get_telemetry().summary()
+    with st.sidebar:
+        st.subheader("📊 운영 지표")
+        st.dataframe(rows, hide_index=True)
+        st.write("토큰 합계", tokens)
+        st.write("프로바이더", llm_provider_stats())
+        st.write("응답 캐시 적중률", get_response_cache().hit_ratios())
+        if st.button("📦 전체 대화 기록 모으기"):
+            st.download_button("⬇️ 대화 기록 ZIP 받기", get_session_store().export_transcripts(),
+                               file_name=f"litbot_transcripts_{time.strftime('%Y%m%d_%H%M')}.zip",
+                               mime="application/zip")
+
+
+@st.cache_resource
+def get_keyword_classifier():
+    """keywords.json으로 키워드 정규식을 서버 프로세스당 한 번만 생성"""
+    return load_keyword_classifier()
+
+def classify_message(user_message):
+    """메시지를 한 번 훑어서 모든 카테고리의 키워드 적중을 반환"""
+    start = time.perf_counter()
+    hits = get_keyword_classifier().classify(user_message)
+    emit_event("classify", ms=elapsed_ms(start), chars=len(user_message),
+               hits={category: len(found) for category, found in hits.items() if found})
+    return hits
+
+def check_inappropriate_content(user_message, hits=None):
+    """1단계(인라인) 부적절한 발언 감지: keywords.json의 명확한 욕설만 바로 막음
+
+    문맥 의존 표현("여자는" + "원래", "죽어" + "버려" 등)은 소설 인용이나 줄거리 이야기에도 자주 나와서
+    2단계 의미 검사(start_semantic_check)가 답변 생성과 동시에 판단함
+    """
+    hits = hits or classify_message(user_message)
+    expression = get_keyword_classifier().find_profanity(hits)
+    return expression is not None, expression
 
 def create_feedback_message(inappropriate_expression):
     """부적절한 발언에 대한 피드백 메시지 생성"""
     return f"잠깐, '{inappropriate_expression}' 같은 표현은 좀 그런 것 같아. 우리 서로 존중하면서 <별>에 대해 이야기하자. 그런 표현 말고 네 생각을 다시 말해줄래? 소설에서 어떤 부분이 그런 감정을 불러일으켰는지 궁금해."
 
-def check_off_topic(user_message):
-    """소설 <별> 주제 이탈 감지"""
-    
-    # 소설 관련 키워드들
-    novel_keywords = [
-        "소년", "누이", "어머니", "별", "과수노파", "죽음", "가족", 
-        "소설", "작품", "황순원", "이야기", "인물", "주인공"
-    ]
-    
-    # 완전히 다른 주제들
-    off_topic_keywords = [
-        "게임", "아이돌", "연예인", "축구", "야구", "음식", "맛집",
-        "학교", "선생님", "시험", "숙제", "친구들", "취미", "영화",
-        "유튜브", "틱톡", "인스타", "카카오", "네이버", "놀자", "딴얘기", "다른 얘기"  # "놀자", "딴얘기" 추가
-    ]
-    
-    # 소설 관련 키워드가 하나도 없고, 다른 주제 키워드가 있으면
-    has_novel_keyword = any(keyword in user_message for keyword in novel_keywords)
-    has_off_topic = any(keyword in user_message for keyword in off_topic_keywords)
-    
-    # 디버깅용
-    print(f"메시지: {user_message}")
-    print(f"소설 키워드 있음: {has_novel_keyword}")
-    print(f"다른 주제 키워드 있음: {has_off_topic}")
-    
-    # 메시지가 너무 짧지 않고 (3글자 이상), 소설 관련 없으면서 다른 주제면
-    if len(user_message) > 3 and not has_novel_keyword and has_off_topic:
-        return True
-    
-    return False
-
 def create_redirect_message():
     """주제 이탈 시 다시 소설로 유도하는 메시지"""
     redirect_messages = [
@@ -85,136 +155,377 @@ def create_redirect_message():
     import random
     return random.choice(redirect_messages)
 
-def analyze_review_for_final_question(review_content, conversation_messages):
-    """감상문에서 아직 다루지 않은 주요 포인트 찾기"""
-    
-    # 감상문의 주요 키워드들
-    review_keywords = {
-        "소년": ["소년", "아이", "어린"],
-        "누이": ["누이", "누나", "언니"],  
-        "별": ["별", "밤하늘", "빛"],
-        "어머니": ["어머니", "엄마", "모친"],
-        "깨달음": ["깨달", "이해", "알게", "느끼"],
-        "슬픔": ["슬프", "아프", "눈물", "울"],
-        "가족": ["가족", "형제", "혈육"]
-    }
-    
-    # 대화에서 이미 언급된 키워드 찾기
-    conversation_text = " ".join([msg["content"] for msg in conversation_messages])
-    
-    # 감상문에는 있지만 대화에서 안 다룬 주제 찾기
-    unused_topics = []
-    for topic, keywords in review_keywords.items():
-        in_review = any(keyword in review_content for keyword in keywords)
-        in_conversation = any(keyword in conversation_text for keyword in keywords)
-        
-        if in_review and not in_conversation:
-            unused_topics.append(topic)
-    
-    return unused_topics
+def moderation_reply(verdict):
+    """2단계 검사가 걸러낸 메시지에 LLM 답변 대신 보여 줄 안내"""
+    if verdict["label"] == "inappropriate":
+        return create_feedback_message(verdict["expression"])
+    return create_redirect_message()
 
-def create_final_question(unused_topics, review_content):
-    """미사용 주제를 바탕으로 마지막 질문 생성"""
-    
-    final_questions = {
-        "소년": "네가 감상문에서 소년에 대해 썼는데, 소년의 마음 변화 중에서 가장 중요한 순간이 언제였다고 생각해?",
-        "누이": "감상문에서 누이를 언급했는데, 누이가 소년에게 끝까지 사랑을 베푼 이유가 뭐라고 생각해?",
-        "별": "네가 '별'에 대해 쓴 부분이 인상적이었어. 소설에서 별이 어떤 의미인지 너만의 해석을 들려줄래?",
-        "어머니": "감상문에서 어머니를 언급했는데, 어머니의 부재가 이 가족에게 어떤 영향을 줬다고 봐?",
-        "깨달음": "네가 쓴 '깨달음' 부분이 궁금해. 소년이 마지막에 진짜 깨달은 게 뭐라고 생각해?",
-        "슬픔": "감상문에서 슬픔에 대해 썼는데, 이 소설에서 가장 슬픈 장면이 어디였어?",
-        "가족": "가족 관계에 대한 네 생각이 궁금해. 이 소설이 가족의 의미에 대해 뭘 말하고 있다고 봐?"
-    }
-    
-    if unused_topics:
-        chosen_topic = unused_topics[0]  # 첫 번째 미사용 주제 선택
-        return final_questions.get(chosen_topic, "마지막으로, 이 소설에서 가장 인상 깊었던 부분이 뭐야?")
-    else:
-        return "마지막으로, 이 소설을 읽고 네가 가장 많이 생각하게 된 건 뭐야?"
+def append_message(role, content, hits=None):
+    """대화 기록에 메시지를 추가하면서 다룬 감상문 주제도 함께 갱신 (마지막 질문용)"""
+    st.session_state.messages.append({"role": role, "content": content})
+    if "student_id" in st.session_state:
+        get_session_store().append(st.session_state.student_id, len(st.session_state.messages) - 1, role, content)
+    hits = hits or classify_message(content)
+    st.session_state.setdefault("covered_topics", set()).update(get_keyword_classifier().topics(hits))
 
-# GitHub에서 소설 전문 가져오기
-@st.cache_data
-def load_novel_from_github():
-    try:
-        # GitHub raw URL 형식으로 수정 필요
-        url = "https://raw.githubusercontent.com/mveishu/star/main/novel_star.txt"
-        response = requests.get(url)
-        response.encoding = 'utf-8'
-        if response.status_code == 200:
-            return response.text
-        else:
-            return None
-    except Exception as e:
-        st.error(f"소설 로딩 오류: {e}")
-        return None
+def analyze_review_for_final_question(review_content, covered_topics):
+    """감상문에서 아직 다루지 않은 주요 포인트 찾기
+
+    covered_topics는 append_message가 메시지를 추가할 때마다 모아 둔 대화 속 주제 집합
+    """
+    if "review_topics" not in st.session_state:  # 배치 모드로 미리 계산해 뒀으면 그대로 씀
+        st.session_state.review_topics = ordered_review_topics(get_keyword_classifier(), review_content)
+
+    # 감상문에는 있지만 대화에서 안 다룬 주제 찾기 (keywords.json 순서 유지)
+    return [topic for topic in st.session_state.review_topics if topic not in covered_topics]
+
+@st.cache_resource
+def load_novel():
+    """소설 본문과 미리 계산한 부가 정보를 서버 프로세스당 한 번 로딩 (네트워크 없이 시작)
+
+    같은 본문의 계산 결과는 .litbot_cache/에 저장해서 재시작할 때 다시 쓰고,
+    secrets의 [novel] refresh_from_github = true일 때만 GitHub 본문으로 갱신함
+    """
+    return load_novel_artifacts(st.secrets.get("novel", {}).get("refresh_from_github", False))
 
 # 소설 전문 로딩
-novel_full_text = load_novel_from_github()
+novel_artifacts = load_novel()
+novel_full_text = novel_artifacts["text"] if novel_artifacts else None
 
 # 기존 요약 대신 전문 사용 또는 백업 요약
 if novel_full_text:
     novel_content = novel_full_text
     st.success("✅ 소설 전문을 성공적으로 로딩했습니다.")
 else:
-    # 백업 요약
-    novel_content = """
-    이 소설은 아홉 살 소년이 과수 노파로부터 누이가 돌아간 어머니와 닮았다는 말을 듣고 어머니에 대한 환상을 품게 되지만, 누이의 실제 모습에 실망하며 그녀를 거부하고 냉대하는 과정을 그린다. 소년은 누이가 베푸는 어머니 같은 사랑을 인정하지 않으려 하고, 누이의 연애 사건과 결혼, 그리고 죽음에 이르기까지 지속적으로 그녀를 멀리하지만, 결국 누이의 죽음 후에야 눈물을 흘리며 그녀 역시 어머니처럼 아름다운 별이 될 수 있음을 깨닫는다.
-    """
+    novel_content = BACKUP_SUMMARY
     st.warning("⚠️ 소설 전문 로딩 실패, 요약 사용 중")
 
-from openai import OpenAI
-client = OpenAI(api_key=st.secrets["openai"]["api_key"])
+@st.cache_resource
+def get_prompt_builder(content_hash, _novel_content):
+    """서버 프로세스당 한 번만 소설 색인과 소설 전문 블록 생성 (본문 대신 해시로 캐시 키를 잡아서 재실행마다 본문을 해싱하지 않음)"""
+    return PromptBuilder(_novel_content)
+
+NOVEL_CACHE_KEY = novel_artifacts["content_hash"] if novel_artifacts else "summary"
+build_system_blocks = get_prompt_builder(NOVEL_CACHE_KEY, novel_content).system_blocks
+
+@st.cache_resource
+def get_semantic_checker(content_hash, _novel_content):
+    """서버 프로세스당 한 번만 2단계 의미 검사기 준비 (소설 색인은 프롬프트용과 같이 씀)"""
+    return load_semantic_checker(get_keyword_classifier(),
+                                 get_prompt_builder(content_hash, _novel_content).passage_index, _novel_content)
+
+@st.cache_resource
+def get_moderation_executor():
+    """2단계 의미 검사 전용 작업 스레드 (메시지 하나에 1ms 안팎이라 LLM 스레드와 따로 둬도 2개면 충분)"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="moderation")
+
+def start_semantic_check(user_message, hits):
+    """주제 이탈·돌려 말한 욕설·소설 인용 판단을 본 LLM 호출과 동시에 시작하고 Future 반환"""
+    checker = get_semantic_checker(NOVEL_CACHE_KEY, novel_content)  # 작업 스레드에서는 st 캐시를 부르지 않음
+    return get_moderation_executor().submit(checker.check, user_message, hits)
+
+def record_cache_usage(usage):
+    """답한 모델의 캐시 적중/미적중 토큰 수 기록 (GPT 사용량도 record_gpt_usage가 같은 키로 맞춰 둠)"""
+    stats = {
+        "input_tokens": usage.get("input_tokens", 0),
+        "cache_hit_tokens": usage.get("cache_read_input_tokens", 0),
+        "cache_miss_tokens": usage.get("cache_creation_input_tokens", 0) + usage.get("input_tokens", 0),
+        "output_tokens": usage.get("output_tokens", 0),
+    }
+    st.session_state.setdefault("cache_usage", []).append(stats)
+    return stats
+
+@st.cache_resource
+def get_llm_providers():
+    """서버 프로세스당 한 번만 만드는 프로바이더 클라이언트와 작업 스레드 풀 (모든 세션이 공유)"""
+    return create_llm_providers(st.secrets)
+
+@st.cache_resource
+def get_admission_scheduler():
+    """서버 프로세스당 하나의 입장 관리자 (모든 학생 세션이 공유)"""
+    return create_admission_scheduler(st.secrets)
+
+def session_admission(conversation_history, system_prompt, priority, on_wait=None):
+    """현재 세션 이름으로 공유 대기열에 넣을 입장 요청"""
+    return admission_request(get_admission_scheduler(), conversation_history, system_prompt, priority,
+                             current_session_id(), on_wait)
+
+def wait_notice():
+    """대기 중이면 예상 대기 시간을 보여주는 on_wait 콜백과 그 자리표시자"""
+    placeholder = st.empty()
+
+    def on_wait(seconds):
+        placeholder.info(f"⏳ 지금 친구들이 한꺼번에 이야기하고 있어서 약 {max(1, round(seconds))}초 기다려야 해. 조금만 기다려줘!")
 
-def get_chatbot_response(conversation_history, system_prompt):
+    return on_wait, placeholder
+
+def llm_provider_stats():
+    """운영자용 프로바이더별 지연 시간·오류·대체 호출 카운터"""
+    providers = get_llm_providers()
+    return {name: providers[name].stats() for name in ["claude", "gpt"]}
+
+# 대기열이 너무 길거나 모든 모델이 실패했을 때 오류 화면 대신 보여주는 안내
+BUSY_MESSAGE = "미안, 지금 친구들이 한꺼번에 이야기하고 있어서 답을 못 했어. 잠시 뒤에 방금 한 말을 다시 보내줄래?"
+
+def record_first_token(start_time):
+    """이번 턴의 첫 토큰까지 걸린 시간(TTFT) 기록"""
+    st.session_state.setdefault("ttft", []).append(round(time.time() - start_time, 3))
+
+# 마무리 인사를 만들지 못했을 때 대신 쓰는 인사 (대화가 끝난 뒤라 다시 보내 달라고 할 수 없음)
+CLOSING_FALLBACK = "{name}, 오늘 <별>에 대해 네 생각을 들려줘서 정말 고마워! 이야기 나누면서 나도 많이 배웠어. 아래에서 성찰일지도 꼭 써 줘."
+
+# 답이 도중에 끊겼을 때 잘린 답 대신 보여주고 대화 기록에 남기는 안내
+CUT_OFF_MESSAGE = "앗, 내 답이 중간에 끊겼어. 미안! 방금 한 말을 한 번만 다시 보내줄래?"
+
+def stream_chatbot_response(conversation_history, system_prompt, priority="turn", outcome=None):
+    """Claude 답변을 SSE로 받아 조각 단위로 내보내는 제너레이터 (실패 시 GPT-4o 스트리밍)
+
+    outcome 딕셔너리를 넘기면 스트림이 정상적으로 끝났을 때만 complete=True와 답한 프로바이더 이름을,
+    답이 도중에 끊겼으면 interrupted=True를, 답을 못 받았으면 failed=True를 적어 줌
+    (중간에 닫힌 스트림은 아무것도 적지 않음)
+    """
+    start_time = time.time()
+    start = time.perf_counter()
+    ttft_ms = None
+    conversation_history = [
+        {"role": m["role"], "content": m["content"].rstrip()}
+        for m in conversation_history
+    ]
+    providers = get_llm_providers()
+    usage = {"claude": {}, "gpt": {}}  # 헤지하면 두 모델이 동시에 돌 수 있어서 따로 받음
+    provider_name = None
+    on_wait, notice = wait_notice()
     try:
-                # Claude API 호출 전, assistant 메시지 끝 공백 제거
-        conversation_history = [
-            {"role": m["role"], "content": m["content"].rstrip()}
-            for m in conversation_history
-        ]
-        headers = {
-            "x-api-key": st.secrets["claude"]["api_key"],
-            "anthropic-version": "2023-06-01",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": "claude-sonnet-4-20250514",
-            "max_tokens": 512,
-            "system": system_prompt,
-            "messages": conversation_history
-        }
-        res = requests.post("https://api.anthropic.com/v1/messages", headers=headers, json=data)
-
-        if res.status_code == 200:
-            return res.json()["content"][0]["text"]
-
-        elif res.status_code in [429, 500, 503, 408]:
-            st.warning("⚠️ AI 사용량이 많아 잠시 다른 모델로 응답할게!")  # 생략 가능
-            gpt_messages = [{"role": "system", "content": system_prompt}] + conversation_history
-            gpt_res = client.chat.completions.create(
-                model="gpt-4o",
-                messages=gpt_messages,
-                max_tokens=512,
-                temperature=0.8,
-            )
-            return gpt_res.choices[0].message.content
+        for provider_name, chunk in stream_with_fallback(
+            (providers["claude"], lambda: claude_stream(providers["claude"], conversation_history, system_prompt,
+                                                        usage["claude"])),
+            (providers["gpt"], lambda: gpt_stream(providers["gpt"], conversation_history, system_prompt, usage["gpt"])),
+            providers["executor"],
+            admission=session_admission(conversation_history, system_prompt, priority, on_wait),
+        ):
+            if start_time is not None:
+                notice.empty()
+                record_first_token(start_time)
+                start_time = None
+                ttft_ms = elapsed_ms(start)
+                if provider_name != "claude":
+                    st.warning("⚠️ AI 사용량이 많아 잠시 다른 모델로 응답할게!")
+            yield chunk
+    except StreamInterrupted as e:
+        emit_event("llm", stream=True, provider=provider_name, ms=elapsed_ms(start), ttft_ms=ttft_ms,
+                   interrupted=True, error=str(e)[:200])
+        if outcome is not None:
+            outcome["interrupted"] = True
+        return
+    except ProviderError as e:
+        notice.empty()
+        emit_event("llm", stream=True, ms=elapsed_ms(start), error=str(e)[:200],
+                   admission_timeout=isinstance(e, AdmissionTimeout))
+        if outcome is not None:
+            outcome["failed"] = True
+        yield BUSY_MESSAGE if e.retryable else str(e)
+        return
+
+    if outcome is not None:
+        outcome["complete"] = True
+        outcome["provider"] = provider_name
+    token_stats = record_cache_usage(usage[provider_name]) if provider_name else {}
+    emit_event("llm", stream=True, provider=provider_name, fallback=provider_name != "claude",
+               ms=elapsed_ms(start), ttft_ms=ttft_ms, **token_stats)
+
+@st.cache_resource
+def get_response_cache():
+    """서버 프로세스당 하나의 응답 캐시 (secrets의 [response_cache] sqlite = true면 디스크에도 저장)"""
+    config = st.secrets.get("response_cache", {})
+    sqlite_path = config.get("sqlite_path", ARTIFACT_DIR / "responses.sqlite3") if config.get("sqlite") else None
+    return ResponseCache(sqlite_path, ttl=config.get("ttl", RESPONSE_CACHE_TTL),
+                         memory_items=config.get("memory_items", RESPONSE_CACHE_MEMORY_ITEMS),
+                         disk_items=config.get("disk_items", RESPONSE_CACHE_DISK_ITEMS))
+
+def write_stream_response(conversation_history, system_prompt, transient=False, priority="turn", cache_stage=None,
+                          moderation=None):
+    """답변을 채팅 말풍선에 실시간으로 출력하고 최종 텍스트 반환
+
+    transient=True면 다 받은 뒤 말풍선을 지움 (아래 대화 기록 루프가 다시 그리는 경우)
+    cache_stage를 주면 같은 입력의 이전 답을 다시 쓰고, 동시에 들어온 같은 요청은 한 번만 호출함
+    moderation(2단계 검사 Future)을 주면 검사가 메시지를 걸렀을 때 LLM 스트림을 끊고 안내 문구로 바꿈
+    답이 도중에 끊기면 잘린 답 대신 CUT_OFF_MESSAGE를 보여주고 반환함 (잘린 답은 저장하지 않음)
+    첫 질문·마무리(priority가 "turn"이 아닌 경우)에서 답을 못 받거나 끊기면 None을 반환함:
+    "방금 한 말을 다시 보내줘" 같은 안내는 그 단계에 맞지 않아서 호출한 쪽이 단계에 맞게 처리함
+    """
+    cache = get_response_cache() if cache_stage else None
+    key = response_cache_key(conversation_history, system_prompt) if cache else None
+    response = None
+    flagged = None
+    outcome = {}
+    start = time.perf_counter()
+    if cache:
+        status, value = cache.begin(cache_stage, key)
+        if status == "wait":
+            with st.spinner("리토가 생각 중이야..."):
+                try:
+                    value = value.result(timeout=RESPONSE_CACHE_WAIT)
+                except FuturesTimeout:
+                    value = None
+            # leader가 실패했으면 캐시 없이 직접 호출
+            status = "shared" if value is not None else "miss"
+        if status in ["hit", "shared"]:
+            response = value
+        emit_event("response_cache", stage=cache_stage, outcome=status, ms=elapsed_ms(start))
+
+    placeholder = st.empty()
+    with placeholder.container():
+        with st.chat_message("assistant"):
+            if response is not None:
+                st.markdown(response)
+            else:
+                stream = stream_chatbot_response(conversation_history, system_prompt, priority, outcome)
+                if moderation is not None:
+                    stream = moderated_stream(stream, moderation)
+                try:
+                    response = st.write_stream(stream)
+                except ModerationFlag as e:
+                    flagged = e.verdict
+                finally:
+                    if cache and status == "leader":
+                        # 스트림 끝(None 조각)까지 다 받은 답만 저장 (잘린 답·오류 안내 문구는 저장하지 않음)
+                        if outcome.get("complete") and isinstance(response, str) and response.strip():
+                            cache.finish(key, response)
+                        else:
+                            cache.abandon(key)
+    if moderation is not None:
+        verdict = flagged or finished_verdict(moderation)
+        emit_event("moderation", label=verdict and verdict["label"], check_ms=verdict and verdict["ms"],
+                   replaced=flagged is not None, ms=elapsed_ms(start))
+    # 빈 답은 대화 기록에 넣지 않음 (빈 assistant 메시지가 있으면 이후 Claude 요청이 모두 400으로 거절됨)
+    empty = not flagged and not outcome.get("interrupted") and not (isinstance(response, str) and response.strip())
+    if priority != "turn" and (outcome.get("failed") or outcome.get("interrupted") or empty):
+        placeholder.empty()
+        return None
+    if flagged or outcome.get("interrupted") or empty:
+        # 끊긴 답변 조각을 지우고 안내 문구로 바꿈 (검사에 걸린 경우는 보통 첫 조각이 오기 전이라 지울 것이 없음)
+        response = moderation_reply(flagged) if flagged else CUT_OFF_MESSAGE if outcome.get("interrupted") else BUSY_MESSAGE
+        placeholder.empty()
+        with placeholder.container():
+            with st.chat_message("assistant"):
+                st.markdown(response)
+    if transient:
+        placeholder.empty()
+    return response
 
-        else:
-            return f"❌ Claude API 오류: {res.status_code} - {res.text}"
-
-    except Exception as e:
-        st.warning(f"⚠️ AI 사용량이 많아 잠시 다른 모델로 응답할게!")
-        gpt_messages = [{"role": "system", "content": system_prompt}] + conversation_history
-        gpt_res = client.chat.completions.create(
-            model="gpt-4o",
-            messages=gpt_messages,
-            max_tokens=512,
-            temperature=0.8,
-        )
-    return gpt_res.choices[0].message.content
 
+def chat_messages():
+    return [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages if m["role"] in ["user", "assistant"]]
+
+@st.cache_resource
+def get_summary_executor():
+    """백그라운드 요약 전용 작업 스레드 (서버 프로세스당 하나)
+
+    요약 작업은 안에서 call_with_fallback으로 LLM 스레드 풀에 호출을 넘기고 기다리므로, 같은 풀에서 돌리면
+    학생이 많을 때 기다리는 작업이 스레드를 다 차지해서 실시간 답변이 멈출 수 있음. 따로 두고 개수도 제한함.
+    """
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="summary")
+
+def update_history_summary(wait=0):
+    """끝난 요약 작업을 반영하고, 접을 메시지가 새로 쌓였으면 백그라운드 요약을 시작 (답변마다 호출)"""
+    job = st.session_state.get("summary_job")
+    if job is not None:
+        future, target = job
+        try:
+            summary = future.result(timeout=wait)
+        except FuturesTimeout:
+            return
+        except Exception:
+            summary = None  # 실패하면 다음 답변 뒤 다시 시도
+        st.session_state.summary_job = None
+        if summary:
+            st.session_state.history_summary = summary
+            st.session_state.summarized_count = target
+
+    messages = chat_messages()
+    summarized = st.session_state.get("summarized_count", 0)
+    target = fold_boundary(messages)
+    if target > summarized:
+        future = get_summary_executor().submit(
+            summarize_history, get_llm_providers(), get_admission_scheduler(),
+            st.session_state.get("history_summary", ""), messages[summarized:target]
+        )
+        st.session_state.summary_job = (future, target)
+
+def compact_history(messages, budget=HISTORY_TOKEN_BUDGET):
+    """이 세션의 대화 요약과 요약에 접힌 위치로 (요약, 그대로 보낼 최근 메시지)를 구함"""
+    return compact_messages(messages, st.session_state.get("history_summary", ""),
+                            st.session_state.get("summarized_count", 0), budget)
+
+def key_quotes(messages, limit=3, max_chars=150):
+    """학생 발화 중 감상문 주제가 많이 담기고 긴 말을 골라 원문 그대로 인용 (시간 순서 유지)"""
+    classifier = get_keyword_classifier()
+    candidates = [
+        (len(classifier.topics(classify_message(m["content"]))), len(m["content"]), i)
+        for i, m in enumerate(messages) if m["role"] == "user"
+    ]
+    chosen = sorted(i for _, _, i in sorted(candidates, reverse=True)[:limit])
+    return [messages[i]["content"][:max_chars] for i in chosen]
+
+# 감상문 PDF 제한
+PDF_MAX_BYTES = 10 * 1024 * 1024   # 10MB
+PDF_MAX_PAGES = 30
+PDF_TIMEOUT = 15                   # 초
+
+@st.cache_resource
+def get_pdf_executor():
+    """PDF 파싱 전용 작업 스레드 (CPU를 많이 쓰므로 동시에 2개까지만)"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="pdf")
+
+@st.cache_data(max_entries=200, show_spinner=False)
+def extract_pdf_cached(content_hash, _content, _parsed=None):
+    """내용 해시가 같은 PDF는 재실행·중복 업로드 때 다시 파싱하지 않음 (실제로 파싱하면 _parsed에 표시)"""
+    if _parsed is not None:
+        _parsed["parsed"] = True
+    future = get_pdf_executor().submit(extract_pdf_text, _content, PDF_MAX_PAGES, PDF_TIMEOUT)
+    return future.result(timeout=PDF_TIMEOUT + 1)
+
+def extract_text_from_pdf(uploaded_file):
+    """업로드된 PDF 감상문에서 텍스트 추출 (크기·쪽 수·시간 제한, 결과 캐시)"""
+    content = uploaded_file.getvalue()  # BytesIO에 쓰기가 없었다면 복사 없이 내부 버퍼를 그대로 돌려줌
+    if len(content) > PDF_MAX_BYTES:
+        raise PdfExtractionError(f"PDF가 너무 커요. {PDF_MAX_BYTES // (1024 * 1024)}MB 이하로 올려주세요.")
+    start = time.perf_counter()
+    parsed = {}
+    try:
+        with st.spinner("📄 PDF를 읽는 중..."):
+            result = extract_pdf_cached(hashlib.sha256(content).hexdigest(), content, parsed)
+    except FuturesTimeout:
+        raise PdfExtractionError("PDF를 읽는 데 시간이 너무 오래 걸려요. 텍스트로 직접 입력해주세요.")
+    if not result["text"]:
+        raise PdfExtractionError("PDF에서 글자를 찾지 못했어요. 스캔한 파일이라면 직접 입력해주세요.")
+
+    st.session_state.pdf_stats = {k: v for k, v in result.items() if k != "text"}
+    # ms는 이번 호출에 실제로 걸린 시간 (캐시 적중이면 0에 가까움), extract_ms는 처음 파싱할 때 걸린 시간
+    emit_event("pdf_extract", ms=elapsed_ms(start), cached=not parsed, extract_ms=round(result["elapsed"] * 1000, 2),
+               **{k: v for k, v in st.session_state.pdf_stats.items() if k != "elapsed"})
+    st.caption(f"📄 {result['pages']}쪽, {result['chars']:,}자 추출 ({result['elapsed']:.2f}초)")
+    if result["truncated"]:
+        st.info(f"PDF가 길어서 앞 {result['pages']}쪽까지만 읽었어요.")
+    return result["text"]
+
+@st.cache_resource
+def get_email_outbox():
+    """서버 프로세스당 하나의 발송함 (모든 세션이 공유)"""
+    email_secrets = st.secrets["email"]
+    return EmailOutbox(
+        Path(email_secrets.get("outbox_dir", OUTBOX_DIR)),  # 부하 테스트 등에서 임시 폴더로 바꿔 씀
+        host=email_secrets.get("smtp_host", "smtp.gmail.com"),
+        port=int(email_secrets.get("smtp_port", 465)),
+        user=email_secrets["user"],
+        password=email_secrets["password"],
+        use_ssl=email_secrets.get("smtp_ssl", True),  # 로컬 디버깅 SMTP 서버는 False
+        telemetry=get_telemetry(),
+    )
 
 def send_email_with_attachment(file, subject, body, filename):
+    """메일을 발송함에 넣고 바로 반환 (실제 발송은 백그라운드에서)"""
     msg = EmailMessage()
     msg["Subject"] = subject
     msg["From"] = st.secrets["email"]["user"]
@@ -222,27 +533,36 @@ def send_email_with_attachment(file, subject, body, filename):
     msg.set_content(body)
     file_bytes = file.read()
     msg.add_attachment(file_bytes, maintype="application", subtype="octet-stream", filename=filename)
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-        smtp.login(st.secrets["email"]["user"], st.secrets["email"]["password"])
-        smtp.send_message(msg)
+    # 같은 제목·파일명·내용의 메일은 재실행이나 재업로드로 다시 들어와도 한 번만 보냄
+    dedup_key = hashlib.sha256(f"{subject}\0{filename}\0".encode("utf-8") + file_bytes).hexdigest()[:32]
+    start = time.perf_counter()
+    queued = get_email_outbox().enqueue(msg, dedup_key)
+    emit_event("email_enqueue", ms=elapsed_ms(start), bytes=len(file_bytes), duplicate=not queued)
+    return queued
+
+render_operator_summary()
 
 st.markdown("""
 <h1 style='text-align: left;'>📚 문학 토론 챗봇 - 리토</h1>
 <h3 style='text-align: right; margin-top: -20px;'>:황순원, <별> 🌟</h3>
 """, unsafe_allow_html=True)
 
-col1, col2 = st.columns(2)
+col1, col2, col3 = st.columns(3)
 with col1:
     user_lastname = st.text_input("성을 입력해주세요", key="lastname")
 with col2:
     user_firstname = st.text_input("이름을 입력해주세요", key="firstname")
+with col3:
+    student_code = st.text_input("학생 코드를 정해주세요", key="student_code", type="password",
+                                 help="다시 접속해서 대화를 이어갈 때 같은 코드를 입력해야 해요.")
 
-if user_lastname and user_firstname:
+if user_lastname and user_firstname and student_code:
     user_name = user_firstname
+    restore_session(user_lastname, user_firstname, student_code)
     st.success(f"안녕하세요, {user_name}님! 감상문을 업로드해주세요.")
 else:
-    st.warning("👤 이름을 입력해주세요.")
-    st.stop()
+    st.warning("👤 이름과 학생 코드를 입력해주세요.")
+    stop_script()
 
 st.subheader("📄 감상문 제출 방식 선택")
 input_method = st.radio("어떻게 감상문을 제출하시겠어요?", ["파일 업로드", "직접 입력"], key="review_method")
@@ -254,10 +574,14 @@ if input_method == "파일 업로드":
         if filename.endswith(".txt"):
             file_content = uploaded_review.read().decode("utf-8")
         elif filename.endswith(".pdf"):
-            file_content = extract_text_from_pdf(uploaded_review)
+            try:
+                file_content = extract_text_from_pdf(uploaded_review)
+            except PdfExtractionError as e:
+                st.error(str(e))
+                stop_script()
         else:
             st.error("지원되지 않는 파일 형식입니다.")
-            st.stop()
+            stop_script()
 
         uploaded_review.seek(0)
         send_email_with_attachment(uploaded_review, f"[감상문] {user_name}_감상문", "사용자가 업로드한 감상문입니다.", uploaded_review.name)
@@ -281,24 +605,45 @@ for key in ["messages", "start_time", "chat_disabled", "final_prompt_mode"]:
     if key not in st.session_state:
         st.session_state[key] = [] if key == "messages" else False
 
-if st.session_state.get("review_sent") and not st.session_state.get("start_time"):
-    st.session_state.start_time = time.time()
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": f"안녕, {user_name}! 난 리토야. 우리 아까 읽은 소설 <별>에 대해 함께 이야기해볼까? 네가 적은 감상문 잘 읽었어!"
-    })
-
-    first_question = get_chatbot_response(
-    [{"role": "user", "content": "감상문을 읽고 사용자와 다른 관점을 제시하면서 자연스럽게 질문해줘. '나는 네가 A부분에서 B에 주목한 게 인상적이었어. 왜냐면 나는 같은 장면에서 C가 더 신경쓰였거든' 같은 방식으로"}],
-    f"""
-너는 {user_name}와 함께 소설 <별>을 읽은 동료 학습자야. 같은 책을 읽은 친구처럼 행동해.
-작품 전문: {novel_content}
-{user_name}의 감상문: {st.session_state.file_content}
-
-감상문에서 언급된 내용에 대해 다른 시각을 제시하면서 자연스럽게 대화를 시작해.
-"""
-)
-    st.session_state.messages.append({"role": "assistant", "content": first_question})
+# 인사만 있고 첫 질문이 없으면 (첫 질문을 만드는 도중에 끊겼거나 실패했던 세션 포함) 첫 질문을 만듦
+if st.session_state.get("review_sent") and len(st.session_state.messages) < 2:
+    if not st.session_state.messages:
+        append_message("assistant", f"안녕, {user_name}! 난 리토야. 우리 아까 읽은 소설 <별>에 대해 함께 이야기해볼까? 네가 적은 감상문 잘 읽었어!")
+    persist_session()  # 첫 질문을 만드는 도중에 끊겨도 감상문을 다시 올리지 않도록 먼저 저장
+
+    opening_history = [{"role": "user", "content": OPENING_REQUEST}]
+    opening_prompt = build_system_blocks(
+        user_name,
+        st.session_state.file_content,
+        OPENING_INSTRUCTIONS,
+        query=st.session_state.file_content
+    )
+    # 배치 모드(litbot_batch.py)로 미리 만든 첫 질문이 지금과 같은 프롬프트로 만든 것이면 LLM을 부르지 않고 바로 시작
+    # (배치 뒤에 소설 본문·페르소나·발췌 규칙이 바뀌었으면 해시가 달라서 새로 만듦)
+    prepared = get_session_store().load_prepared(prepared_key(user_name, st.session_state.file_content))
+    if prepared and prepared["prompt_hash"] == response_cache_key(opening_history, opening_prompt):
+        first_question = prepared["opening"]
+        st.session_state.review_topics = prepared["review_topics"]
+        emit_event("opening_prepared", chars=len(first_question))
+    else:
+        if prepared:
+            emit_event("opening_prepared_stale")
+        first_question = write_stream_response(
+            opening_history,
+            opening_prompt,
+            transient=True,
+            priority="opening",
+            cache_stage="opening"
+        )
+    if first_question is None:
+        # 인사만 남겨 두고 멈춤: 다음 재실행에서 첫 질문을 다시 만듦 (대화 시간도 그때부터 셈)
+        st.warning("⏳ 지금 친구들이 한꺼번에 들어와서 리토가 첫 질문을 아직 못 만들었어요. 잠시 뒤 아래 버튼을 눌러주세요.")
+        st.button("🔄 다시 시도", key="retry_opening")
+        stop_script()
+    append_message("assistant", first_question)
+    if not st.session_state.get("start_time"):
+        st.session_state.start_time = time.time()  # 첫 질문이 나온 때부터 대화 시간을 셈
+    update_history_summary()
 
 elapsed = time.time() - st.session_state.start_time if st.session_state.start_time else 0
 
@@ -307,27 +652,34 @@ if elapsed > 480 and elapsed <= 600 and "eight_min_warning" not in st.session_st
     st.session_state.eight_min_warning = True
     
     # 감상문 분석해서 맞춤형 질문 생성
-    unused_topics = analyze_review_for_final_question(st.session_state.file_content, st.session_state.messages)
+    unused_topics = analyze_review_for_final_question(st.session_state.file_content, st.session_state.get("covered_topics", set()))
     final_question = create_final_question(unused_topics, st.session_state.file_content)
     
     warning_msg = f"우리 대화 시간이 얼마 남지 않았네. 마지막으로, {final_question}"
-    st.session_state.messages.append({"role": "assistant", "content": warning_msg})
+    append_message("assistant", warning_msg)
 
 # 10분 후 종료
 if elapsed > 600 and not st.session_state.final_prompt_mode:
     st.session_state.final_prompt_mode = True
     st.session_state.chat_disabled = True
 
-    final_prompt = f"""
+    # 전체 기록 대신 압축된 대화 + 학생의 핵심 발언 인용으로 정리
+    update_history_summary(wait=5)
+    history_summary, claude_messages = compact_history(chat_messages())
+    quotes = "\n".join(f"- \"{q}\"" for q in key_quotes(chat_messages()))
+    final_prompt = build_system_blocks(user_name, st.session_state.file_content, f"""
 지금은 마지막 응답이야. 사용자와 나눈 대화를 정리하고 인사로 마무리해줘.
 질문은 하지 마. 짧고 따뜻하게 끝내줘. 3문장 이내로 말해줘.
 
-작품 전문: {novel_content}
-감상문: {st.session_state.file_content}
-"""
-    claude_messages = [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages if m["role"] in ["user", "assistant"]]
-    response = get_chatbot_response(claude_messages, final_prompt)
-    st.session_state.messages.append({"role": "assistant", "content": response})
+{user_name}의 핵심 발언:
+{quotes}
+""", history_summary=history_summary)
+    response = write_stream_response(claude_messages, final_prompt, transient=True, priority="closing",
+                                     cache_stage="closing")
+    if response is None:
+        # 마무리 인사를 못 받았으면 대화기록 메일에 대기 안내 대신 정해진 인사를 남김
+        response = CLOSING_FALLBACK.format(name=user_name)
+    append_message("assistant", response)
 
     log_lines = [f"{'리토' if m['role']=='assistant' else user_name}의 말: {m['content']}" for m in st.session_state.messages]
     log_text = "\n".join(log_lines)
@@ -346,58 +698,58 @@ for m in st.session_state.messages:
 if not st.session_state.get("chat_disabled") and st.session_state.get("file_content"):
     if prompt := st.chat_input("✍️ 대화를 입력하세요"):
         # 먼저 부적절한 발언 체크
-        is_inappropriate, inappropriate_word = check_inappropriate_content(prompt)
+        hits = classify_message(prompt)  # 한 번만 훑고 아래 검사들이 결과를 같이 씀
+        is_inappropriate, inappropriate_word = check_inappropriate_content(prompt, hits)
         
         # 사용자 메시지 먼저 표시 (공통)
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        append_message("user", prompt, hits)
         with st.chat_message("user"):
             st.markdown(prompt)
 
         if is_inappropriate:
-            # 부적절한 발언 시 피드백만 표시
+            # 명확한 욕설은 LLM을 부르지 않고 피드백만 표시
             feedback_msg = create_feedback_message(inappropriate_word)
-            st.session_state.messages.append({"role": "assistant", "content": feedback_msg})
+            append_message("assistant", feedback_msg)
             with st.chat_message("assistant"):
               st.markdown(feedback_msg)
-        elif check_off_topic(prompt):
-            # 주제 이탈 체크
-            redirect_msg = create_redirect_message()
-            st.session_state.messages.append({"role": "assistant", "content": redirect_msg})
-            with st.chat_message("assistant"):
-                st.markdown(redirect_msg)
         else:
-            # 정상 대화 진행 (사용자 메시지 표시는 이미 위에서 했으므로 제거)
-        
-                system_prompt = f"""
-                너는 {user_name}와 함께 소설 <별>을 읽은 동료 학습자야. 
-                작품 전문: {novel_content}
-                감상문: {st.session_state.file_content}
-
-                **중요한 원칙**:
-                1. 절대 교사나 정답 제공자 역할 금지 - 너도 같은 학습자일 뿐
-                2. 단정적, 확정적 진술 금지 - 항상 "나는 이렇게 봤는데", "혹시 이런 건 어떨까?" 식으로
-                3. **반문 필수** - 사용자 의견에 "정말 그럴까?", "다른 관점에서는 어떨까?", "근데 혹시..." 같은 반문하기
-                4. 사용자와 **다른 해석이나 반대 의견**을 적극적으로 제시하기
-                5. 계속 질문하면서 사용자가 스스로 해석하도록 유도
-                6. 소설 원문의 구체적 장면이나 대사를 언급하며 토론
-
-                **말투**:
-                - 친근한 반말 사용 ("그런데 말이야", "나는 좀 다르게 봤어", "진짜?", "어?")
-                - 같은 또래 친구처럼 자연스럽게
-
-                대화 방식:
-                - "나는 그 장면에서 이런 느낌이었는데, 너는 어떻게 봤어?"
-                - "어? 정말? 나는 오히려 '나'가 더 복잡했던 것 같은데... 왜 그렇게 생각해?"
-                - "그런데 혹시 마들렌 입장에서는 달랐을 수도 있지 않을까?"
-                - "음... 근데 그게 정말 그런 의미일까? 나는 좀 다르게 봤거든"
-
-                3문장 이내로 친근한 반말로 **반문하면서** 대화해줘.
-                """
-                claude_messages = [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages if m["role"] in ["user", "assistant"]]
-                response = get_chatbot_response(claude_messages, system_prompt)
-                st.session_state.messages.append({"role": "assistant", "content": response})
+            # 주제 이탈·돌려 말한 욕설은 2단계 검사가 답변 생성과 동시에 판단 (걸리면 답변 대신 안내, 평소엔 지연 없음)
+            # 사용자 메시지 표시는 이미 위에서 했으므로 제거
+            moderation = start_semantic_check(prompt, hits)
+            history_summary, claude_messages = compact_history(chat_messages())
+            system_prompt = build_system_blocks(user_name, st.session_state.file_content, """
+            **중요한 원칙**:
+            1. 절대 교사나 정답 제공자 역할 금지 - 너도 같은 학습자일 뿐
+            2. 단정적, 확정적 진술 금지 - 항상 "나는 이렇게 봤는데", "혹시 이런 건 어떨까?" 식으로
+            3. **반문 필수** - 사용자 의견에 "정말 그럴까?", "다른 관점에서는 어떨까?", "근데 혹시..." 같은 반문하기
+            4. 사용자와 **다른 해석이나 반대 의견**을 적극적으로 제시하기
+            5. 계속 질문하면서 사용자가 스스로 해석하도록 유도
+            6. 소설 원문의 구체적 장면이나 대사를 언급하며 토론
+
+            **말투**:
+            - 친근한 반말 사용 ("그런데 말이야", "나는 좀 다르게 봤어", "진짜?", "어?")
+            - 같은 또래 친구처럼 자연스럽게
+
+            대화 방식:
+            - "나는 그 장면에서 이런 느낌이었는데, 너는 어떻게 봤어?"
+            - "어? 정말? 나는 오히려 '나'가 더 복잡했던 것 같은데... 왜 그렇게 생각해?"
+            - "그런데 혹시 마들렌 입장에서는 달랐을 수도 있지 않을까?"
+            - "음... 근데 그게 정말 그런 의미일까? 나는 좀 다르게 봤거든"
+
+            3문장 이내로 친근한 반말로 **반문하면서** 대화해줘.
+            """, query=prompt, history_summary=history_summary)
+            # 검사는 보통 1ms 안팎이라 여기까지 오면 끝나 있음: 걸린 메시지는 LLM을 아예 부르지 않음
+            verdict = finished_verdict(moderation, MODERATION_PRECHECK)
+            if verdict and verdict["flagged"]:
+                response = moderation_reply(verdict)
+                emit_event("moderation", label=verdict["label"], check_ms=verdict["ms"], replaced=True,
+                           precheck=True)
                 with st.chat_message("assistant"):
                     st.markdown(response)
+            else:
+                response = write_stream_response(claude_messages, system_prompt, moderation=moderation)
+            append_message("assistant", response)
+            update_history_summary()
 
 if st.session_state.chat_disabled:
     st.markdown("---")
@@ -433,10 +785,7 @@ if st.session_state.chat_disabled:
 
     if st.session_state.get("reflection_sent"):
         st.success("🎉 모든 절차가 완료되었습니다. 실험에 참여해주셔서 감사합니다!")
-        st.stop()
-
-
-
-
-
+        stop_script()
 
+persist_session()
+emit_event("rerun", ms=elapsed_ms(RERUN_STARTED), imports_ms=IMPORTS_MS, stopped=False)